@@ -0,0 +1,80 @@
+import os
+import shutil
+import hashlib
+
+# content-addressed geometry storage of a collection: geometry files are
+# stored once in <root>/.blobs/<2 first hex chars>/<sha1>.<format> and
+# sidecars reference them by their "blob" key ( "<sha1>.<format>" ).
+# The store is enabled per collection by creating the .blobs folder.
+BLOB_FOLDER = ".blobs"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def is_enabled(collection_root):
+
+    return os.path.isdir(collection_root + os.sep + BLOB_FOLDER)
+
+def enable(collection_root):
+    """ Store the geometry of the assets published from now on in the
+        content-addressed store of the given collection.
+    """
+    folder = collection_root + os.sep + BLOB_FOLDER
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+def hash_file(path):
+    """ Return the sha1 hex digest of the given file content.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def blob_path(collection_root, key):
+    """ Return the path of the given blob key.
+    """
+    return os.sep.join((collection_root, BLOB_FOLDER, key[:2], key))
+
+def store(collection_root, path, fmt, move=False):
+    """ Add the given geometry file to the store and return its blob key.
+        Nothing is written when the same content is already stored. When
+        move is True the source file is removed.
+    """
+    key = hash_file(path) + '.' + fmt
+    dst = blob_path(collection_root, key)
+
+    if os.path.exists(dst):
+        if move:
+            os.remove(path)
+        return key
+
+    folder = os.path.dirname(dst)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # created meanwhile by another process
+            if not os.path.isdir(folder):
+                raise
+
+    # several processes can store the same blob at once, each one writes
+    # its own temp file, the first rename wins
+    tmp = "{0}.{1}.tmp".format(dst, os.getpid())
+    if move:
+        shutil.move(path, tmp)
+    else:
+        shutil.copyfile(path, tmp)
+
+    try:
+        os.rename(tmp, dst)
+    except OSError:
+        os.remove(tmp)
+        if not os.path.exists(dst):
+            raise
+
+    return key
@@ -0,0 +1,284 @@
+import sys
+import argparse
+import itertools
+import numpy as np
+
+from multiprocessing.pool import ThreadPool
+
+from PySide2 import QtCore
+from PySide2 import QtGui
+
+from . import indexIO
+from . import mipmaps
+
+# dHash of HASH_WIDTH x HASH_HEIGHT gradients, 64 bits
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+
+# max hamming distance between the hashes of near duplicates, up to 3
+# hash chunks are looked up without flipped bits, which is the fastest
+DEFAULT_DISTANCE = 3
+
+# chunk values shared by more hashes are not looked up, see _close_pairs
+MAX_BUCKET = 64
+# max flipped bits of a chunk lookup
+MAX_RADIUS = 2
+# hashes whose lookups can't cover the max distance are compared to every
+# hash, up to MAX_BRUTE_FORCE of them, by blocks of BRUTE_FORCE_BLOCK
+MAX_BRUTE_FORCE = 1024
+BRUTE_FORCE_BLOCK = 16
+
+# number of set bits of every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_POPCOUNT16 = (_POPCOUNT[:, None] + _POPCOUNT[None, :]).ravel()
+
+def thumbnail_pixels(data):
+    """ Return the grayscale pixels ( HASH_HEIGHT rows of HASH_WIDTH + 1 )
+        of the given jpg data, None if it can't be decoded. Thread safe,
+        no QPixmap involved.
+    """
+    image = QtGui.QImage()
+    if not data or not image.loadFromData(data):
+        return None
+
+    image = image.scaled(HASH_WIDTH + 1, HASH_HEIGHT, QtCore.Qt.IgnoreAspectRatio,
+                         QtCore.Qt.SmoothTransformation)
+    return [QtGui.qGray(image.pixel(x, y)) for y in range(HASH_HEIGHT) \
+            for x in range(HASH_WIDTH + 1)]
+
+def dhash(pixels):
+    """ Return the uint64 dHash array of the given ( n, HASH_HEIGHT,
+        HASH_WIDTH + 1 ) grayscale pixels array: one bit per pixel,
+        set when brighter than its right neighbour.
+    """
+    pixels = np.asarray(pixels, dtype=np.int16)
+    bits = pixels[:, :, :-1] > pixels[:, :, 1:]
+    packed = np.packbits(bits.reshape(len(pixels), -1), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+def hamming(a, b):
+    """ Return the bit distances of the given uint64 arrays.
+    """
+    x = np.bitwise_xor(a, b)
+    return _POPCOUNT[x.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+def compute_hashes(collection_root, level=mipmaps.GRID_LEVEL,
+                   workers=indexIO.DEFAULT_WORKERS):
+    """ Hash the thumbnail of every indexed asset without a hash yet and
+        store the hashes in the collection index. The pre-scaled level is
+        used when available, it is faster to decode.
+        Return the number of hashed assets.
+    """
+    index = indexIO.get_index(collection_root)
+    uids = index.unhashed_uids()
+    if not uids:
+        return 0
+
+    def pixels(uid):
+        metadata = index.get_item(uid)
+        if metadata is None:
+            return None
+        return thumbnail_pixels(indexIO.get_thumbnail(collection_root, metadata, level))
+
+    if workers > 1 and len(uids) >= indexIO.PARALLEL_MIN_FILES:
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(pixels, uids, chunksize=64)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [pixels(uid) for uid in uids]
+
+    valid = [(uid, p) for uid, p in zip(uids, results) if p is not None]
+    if not valid:
+        return 0
+
+    grays = np.array([p for _, p in valid]).reshape(len(valid), HASH_HEIGHT,
+                                                    HASH_WIDTH + 1)
+    hashes = dhash(grays)
+    index.set_hashes(zip([uid for uid, _ in valid], hashes.tolist()))
+    return len(valid)
+
+def _flips(radius):
+    """ Return the 16 bits masks of up to radius set bits, by number of
+        set bits.
+    """
+    flips = []
+    for r in range(radius + 1):
+        for bits in itertools.combinations(range(16), r):
+            flips.append((r, sum(1 << b for b in bits)))
+
+    return flips
+
+def _close_pairs(hashes, max_distance, max_bucket=MAX_BUCKET):
+    """ Multi-index hashing: hashes are split in 4 chunks of 16 bits, two
+        hashes within max_distance bits have at least one chunk within
+        max_distance // 4 bits. Every chunk, with each variant of up to
+        max_distance // 4 flipped bits, is looked up in the sorted chunks
+        of all hashes, candidates are checked right away. Return the
+        ( a, b ) index arrays of the pairs within max_distance, a < b.
+        Chunk values shared by more than max_bucket hashes ( e.g. a flat
+        background row ) are saturated and never looked up, which keeps the
+        number of pairs linear. The remaining chunks of those hashes are
+        looked up with a larger radius, up to MAX_RADIUS bits, as the
+        differing bits are spread over fewer chunks. Hashes for which that
+        isn't enough are compared to every hash, see _brute_force_pairs().
+        A pair can still be missed when the chunk of one hash close to the
+        other is a saturated value.
+    """
+    n = len(hashes)
+    keys = [((hashes >> np.uint64(lo)) & np.uint64(0xFFFF)).astype(np.int64) \
+            for lo in range(0, 64, 16)]
+
+    saturated = []
+    for chunk in keys:
+        values, inverse, counts = np.unique(chunk, return_inverse=True,
+                                            return_counts=True)
+        saturated.append(counts[inverse.ravel()] > max_bucket)
+
+    free = 4 - np.sum(saturated, axis=0)
+    radius = np.minimum(max_distance // np.maximum(free, 1), MAX_RADIUS)
+    radius[free == 0] = -1
+
+    flips = _flips(int(radius.max())) if n else []
+    pairs = []
+    for chunk, skip in zip(keys, saturated):
+
+        # only unsaturated chunks are looked up, buckets hold at most
+        # max_bucket hashes
+        targets = np.flatnonzero(~skip)
+        order = targets[np.argsort(chunk[targets], kind="mergesort")]
+        sorted_keys = chunk[order]
+
+        for bits, flip in flips:
+
+            rows = np.flatnonzero(~skip & (radius >= bits))
+            if not len(rows):
+                continue
+
+            query = chunk[rows] ^ flip
+            first = np.searchsorted(sorted_keys, query, "left")
+            counts = np.searchsorted(sorted_keys, query, "right") - first
+            total = counts.sum()
+            if not total:
+                continue
+
+            # every ( hash, matching hash ) pair
+            a = np.repeat(rows, counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            b = order[np.repeat(first, counts) + offsets]
+
+            # a hash may find one it isn't found by, pairs are ordered
+            keep = (a != b) & (hamming(hashes[a], hashes[b]) <= max_distance)
+            a, b = a[keep], b[keep]
+            pairs.append(np.minimum(a, b) * n + np.maximum(a, b))
+
+    # the free chunks of these hashes can't hold max_distance bits within
+    # the lookup radius
+    uncovered = np.flatnonzero((free == 0) | \
+                               (max_distance // np.maximum(free, 1) > MAX_RADIUS))
+    if len(uncovered):
+        if len(uncovered) > MAX_BRUTE_FORCE:
+            print(("Warning: {} hashes share common chunks, only {} are compared "
+                   "to every hash").format(len(uncovered), MAX_BRUTE_FORCE))
+        pairs.extend(_brute_force_pairs(hashes, uncovered[:MAX_BRUTE_FORCE],
+                                        max_distance))
+
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    unique = np.unique(np.concatenate(pairs))
+    return unique // n, unique % n
+
+def _brute_force_pairs(hashes, rows, max_distance):
+    """ Yield the encoded ( a * n + b, a < b ) pairs of the given rows
+        within max_distance of any hash, n is the number of hashes.
+    """
+    n = len(hashes)
+    for start in range(0, len(rows), BRUTE_FORCE_BLOCK):
+
+        block = rows[start:start + BRUTE_FORCE_BLOCK]
+        x = np.bitwise_xor(hashes[block][:, None], hashes[None, :])
+        distances = _POPCOUNT16[x.view(np.uint16)].reshape(len(block), n, 4).sum(axis=2)
+        ai, b = np.nonzero(distances <= max_distance)
+        a = block[ai]
+
+        keep = a != b
+        a, b = a[keep], b[keep]
+        yield np.minimum(a, b) * n + np.maximum(a, b)
+
+def find_duplicates(hashes, max_distance=DEFAULT_DISTANCE):
+    """ Group the given { uid: hash } by near duplicates, assets of a group
+        are linked by hashes within max_distance bits. Return the groups
+        with more than one asset ( lists of uids ), largest first.
+        Exact duplicates are always found. Near duplicates are found by an
+        indexed lookup: when many thumbnails share parts of their hash
+        ( e.g. the same flat background ), a few near duplicates among them
+        can be missed, see _close_pairs().
+    """
+    if not hashes:
+        return []
+
+    uids = list(hashes)
+    values = np.array([hashes[uid] for uid in uids], dtype=np.uint64)
+
+    # exact duplicates share their unique hash
+    unique, inverse = np.unique(values, return_inverse=True)
+
+    # union find of the unique hashes
+    parent = list(range(len(unique)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if max_distance > 0 and len(unique) > 1:
+        a, b = _close_pairs(unique, max_distance)
+        for i, j in zip(a.tolist(), b.tolist()):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+    groups = {}
+    for uid, i in zip(uids, inverse.ravel().tolist()):
+        groups.setdefault(find(i), []).append(uid)
+
+    result = [sorted(g) for g in groups.values() if len(g) > 1]
+    result.sort(key=lambda g: (-len(g), g[0]))
+    return result
+
+def duplicate_groups(collection_root, max_distance=DEFAULT_DISTANCE):
+    """ Hash the assets of the collection not hashed yet and return their
+        near duplicates groups, see find_duplicates().
+    """
+    compute_hashes(collection_root)
+    return find_duplicates(indexIO.get_index(collection_root).get_hashes(),
+                           max_distance)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python -m GaiaCollectionPy.core.duplicates",
+                                     description="Near duplicate assets of a collection")
+    parser.add_argument("collection_root")
+    parser.add_argument("--distance", type=int, default=DEFAULT_DISTANCE,
+                        help=("max hamming distance between thumbnail hashes, "
+                              "near duplicates among thumbnails sharing most of "
+                              "their hash ( flat backgrounds ) may be missed"))
+    args = parser.parse_args()
+
+    # jpg image plugins need an application instance
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+
+    index = indexIO.get_index(args.collection_root)
+    index.index_all()
+
+    n = compute_hashes(args.collection_root)
+    print("{} asset(s) hashed".format(n))
+
+    groups = find_duplicates(index.get_hashes(), args.distance)
+    for group in groups:
+        print(', '.join("{category}/{name}".format(**index.get_item(uid)) \
+                        for uid in group))
+    print("{} group(s) of duplicates".format(len(groups)))
@@ -0,0 +1,445 @@
+import re
+import gzip
+import codecs
+import json
+import struct
+
+# Houdini binary json ( UT_JID ) tokens
+JID_NULL = 0x00
+JID_BOOL = 0x10
+JID_INT8 = 0x11
+JID_INT16 = 0x12
+JID_INT32 = 0x13
+JID_INT64 = 0x14
+JID_REAL16 = 0x18
+JID_REAL32 = 0x19
+JID_REAL64 = 0x1a
+JID_UINT8 = 0x21
+JID_UINT16 = 0x22
+JID_TOKENREF = 0x26
+JID_STRING = 0x27
+JID_TOKENDEF = 0x2b
+JID_VALUE_SEPARATOR = 0x2c
+JID_TOKENUNDEF = 0x2d
+JID_FALSE = 0x30
+JID_TRUE = 0x31
+JID_KEY_SEPARATOR = 0x3a
+JID_UNIFORM_ARRAY = 0x40
+JID_ARRAY_BEGIN = 0x5b
+JID_ARRAY_END = 0x5d
+JID_MAP_BEGIN = 0x7b
+JID_MAP_END = 0x7d
+JID_MAGIC = 0x7f
+
+BINARY_MAGIC = b"\x7fNSJb"
+
+_STRUCTS = {JID_INT8: struct.Struct("<b"),
+            JID_INT16: struct.Struct("<h"),
+            JID_INT32: struct.Struct("<i"),
+            JID_INT64: struct.Struct("<q"),
+            JID_REAL16: struct.Struct("<H"),
+            JID_REAL32: struct.Struct("<f"),
+            JID_REAL64: struct.Struct("<d"),
+            JID_UINT8: struct.Struct("<B"),
+            JID_UINT16: struct.Struct("<H")}
+
+_BRACKETS = {JID_ARRAY_BEGIN: '[', JID_ARRAY_END: ']',
+             JID_MAP_BEGIN: '{', JID_MAP_END: '}'}
+
+# attributes sections of the geometry, with their short names
+ATTRIBUTE_CLASSES = (("pointattributes", "point"),
+                     ("vertexattributes", "vertex"),
+                     ("primitiveattributes", "primitive"),
+                     ("globalattributes", "global"))
+
+_SKIP_CHUNK = 1 << 20
+
+def _half_to_float(h):
+    """ Decode a 16 bits float, not supported by struct on python 2.
+    """
+    sign = -1.0 if h & 0x8000 else 1.0
+    exponent = (h >> 10) & 0x1f
+    mantissa = h & 0x3ff
+
+    if exponent == 0:
+        return sign * mantissa * 2.0 ** -24
+    if exponent == 0x1f:
+        return sign * float("inf") if mantissa == 0 else float("nan")
+
+    return sign * (1.0 + mantissa / 1024.0) * 2.0 ** (exponent - 15)
+
+class _BinaryReader(object):
+    """ Streaming reader of Houdini binary json ( .bgeo ).
+        next() returns ( event, value ) tuples, event being '[', ']', '{',
+        '}' or 'v' for a scalar or uniform array value. Skipped uniform
+        arrays are never loaded in memory.
+    """
+    def __init__(self, f):
+
+        self.f = f
+        self.tokens = {}
+
+    def _read(self, n):
+
+        data = self.f.read(n)
+        if len(data) < n:
+            raise ValueError("Unexpected end of geometry file")
+        return data
+
+    def _skip(self, n):
+
+        while n > 0:
+            chunk = min(n, _SKIP_CHUNK)
+            self._read(chunk)
+            n -= chunk
+
+    def _byte(self):
+
+        return bytearray(self._read(1))[0]
+
+    def _length(self):
+
+        b = self._byte()
+        if b < 0xf1:
+            return b
+        if b == 0xf2:
+            return struct.unpack("<H", self._read(2))[0]
+        if b == 0xf4:
+            return struct.unpack("<I", self._read(4))[0]
+        if b == 0xf8:
+            return struct.unpack("<Q", self._read(8))[0]
+
+        raise ValueError("Invalid length encoding: " + hex(b))
+
+    def _string(self):
+
+        return self._read(self._length()).decode("utf-8")
+
+    def _scalar(self, jid):
+
+        if jid == JID_NULL:
+            return None
+        if jid == JID_TRUE:
+            return True
+        if jid == JID_FALSE:
+            return False
+        if jid == JID_BOOL:
+            return self._byte() != 0
+        if jid == JID_STRING:
+            return self._string()
+        if jid == JID_TOKENREF:
+            return self.tokens[self._length()]
+
+        s = _STRUCTS.get(jid)
+        if s is None:
+            raise ValueError("Unknown binary json token: " + hex(jid))
+
+        v = s.unpack(self._read(s.size))[0]
+        if jid == JID_REAL16:
+            v = _half_to_float(v)
+        return v
+
+    def _uniform_array(self, skip):
+
+        jid = self._byte()
+        n = self._length()
+
+        if jid == JID_BOOL:
+            # bits packed in 32 bits words
+            nwords = (n + 31) // 32
+            if skip:
+                self._skip(nwords * 4)
+                return None
+            words = struct.unpack("<{}I".format(nwords), self._read(nwords * 4))
+            return [bool(words[i // 32] & (1 << (i % 32))) for i in range(n)]
+
+        s = _STRUCTS.get(jid)
+        if s is None:
+            raise ValueError("Unknown uniform array type: " + hex(jid))
+
+        if skip:
+            self._skip(n * s.size)
+            return None
+
+        fmt = "<{}{}".format(n, s.format[-1])
+        values = list(struct.unpack(fmt, self._read(n * s.size)))
+        if jid == JID_REAL16:
+            values = [_half_to_float(v) for v in values]
+        return values
+
+    def next(self, skip=False):
+
+        while True:
+            jid = self._byte()
+
+            if jid == JID_TOKENDEF:
+                token_id = self._length()
+                self.tokens[token_id] = self._string()
+                continue
+            if jid == JID_TOKENUNDEF:
+                self.tokens.pop(self._length(), None)
+                continue
+            if jid in (JID_KEY_SEPARATOR, JID_VALUE_SEPARATOR):
+                continue
+
+            event = _BRACKETS.get(jid)
+            if event:
+                return event, None
+            if jid == JID_UNIFORM_ARRAY:
+                return 'v', self._uniform_array(skip)
+
+            return 'v', self._scalar(jid)
+
+class _AsciiReader(object):
+    """ Streaming tokenizer of Houdini ascii json ( .geo ), same interface
+        as _BinaryReader. The file is read by chunks, skipped values are
+        scanned over without being decoded.
+    """
+    _NUMBER_RE = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+    _STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+    _STRUCT_RE = re.compile(r'[\[\]{}"]')
+    _LITERALS = {"true": True, "false": False, "null": None}
+
+    def __init__(self, f, chunk_size=1 << 16):
+
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = u""
+        self.pos = 0
+        self.eof = False
+        # chunks can cut multi-bytes chars
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def _fill(self):
+        """ Read the next chunk, dropping the consumed part of the buffer.
+            Return False at end of file.
+        """
+        if self.eof:
+            return False
+
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+
+        data = self.decoder.decode(data)
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """ Return the next significant char, skipping separators.
+        """
+        while True:
+            while self.pos < len(self.buffer):
+                c = self.buffer[self.pos]
+                if c in " \t\r\n,:":
+                    self.pos += 1
+                    continue
+                return c
+
+            if not self._fill():
+                raise ValueError("Unexpected end of geometry file")
+
+    def _match(self, regex):
+        """ Match the given regex at the current position, making sure
+            the token isn't cut by the end of the buffer.
+        """
+        # numbers can stop early on a cut exponent ( "1.5e" )
+        while len(self.buffer) - self.pos < 64 and self._fill():
+            pass
+
+        while True:
+            m = regex.match(self.buffer, self.pos)
+            if m and (m.end() < len(self.buffer) or self.eof):
+                return m
+            if not self._fill():
+                if m:
+                    return m
+                raise ValueError("Invalid ascii json token")
+
+    def next(self, skip=False):
+
+        c = self._peek()
+        if c in "[]{}":
+            self.pos += 1
+            return c, None
+
+        if c == '"':
+            m = self._match(self._STRING_RE)
+            self.pos = m.end()
+            return 'v', None if skip else json.loads(m.group(0))
+
+        for literal, value in self._LITERALS.items():
+            while len(self.buffer) - self.pos < len(literal) and self._fill():
+                pass
+            if self.buffer.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return 'v', value
+
+        m = self._match(self._NUMBER_RE)
+        self.pos = m.end()
+        text = m.group(0)
+        if skip:
+            return 'v', None
+        if '.' in text or 'e' in text or 'E' in text:
+            return 'v', float(text)
+        return 'v', int(text)
+
+    def skip_container(self):
+        """ Skip the rest of the current array or map ( the opening bracket
+            being already read ), jumping between structural chars.
+        """
+        depth = 1
+        while depth:
+            m = self._STRUCT_RE.search(self.buffer, self.pos)
+            if m is None:
+                self.pos = len(self.buffer)
+                if not self._fill():
+                    raise ValueError("Unexpected end of geometry file")
+                continue
+
+            c = m.group(0)
+            self.pos = m.start()
+            if c == '"':
+                self.pos = self._match(self._STRING_RE).end()
+                continue
+
+            self.pos += 1
+            depth += 1 if c in "[{" else -1
+
+def _read_value(reader, token=None):
+    """ Read a full json value, token being the already read first token.
+    """
+    event, value = token or reader.next()
+    if event == 'v':
+        return value
+
+    if event == '[':
+        values = []
+        while True:
+            token = reader.next()
+            if token[0] == ']':
+                return values
+            values.append(_read_value(reader, token))
+
+    if event == '{':
+        values = {}
+        while True:
+            token = reader.next()
+            if token[0] == '}':
+                return values
+            values[token[1]] = _read_value(reader)
+
+    raise ValueError("Unexpected json token: " + event)
+
+def _skip_value(reader, token=None):
+
+    event, _ = token or reader.next(skip=True)
+    if event not in "[{":
+        return
+
+    if isinstance(reader, _AsciiReader):
+        reader.skip_container()
+        return
+
+    depth = 1
+    while depth:
+        event, _ = reader.next(skip=True)
+        if event in "[{":
+            depth += 1
+        elif event in "]}":
+            depth -= 1
+
+def _read_attributes(reader):
+    """ Read the attribute names of every class, attributes values are
+        skipped. Each attribute is [ [ metadata ], [ data ] ].
+    """
+    attributes = {}
+    classes = dict(ATTRIBUTE_CLASSES)
+
+    if reader.next()[0] != '[':
+        raise ValueError("Invalid attributes section")
+
+    while True:
+        event, key = reader.next()
+        if event == ']':
+            return attributes
+
+        if reader.next()[0] != '[':
+            raise ValueError("Invalid attributes section")
+
+        names = []
+        while True:
+            token = reader.next()
+            if token[0] == ']':
+                break
+
+            # [ metadata, data ]
+            metadata = _read_value(reader)
+            _skip_value(reader)
+            reader.next()
+
+            metadata = dict(zip(metadata[::2], metadata[1::2]))
+            names.append(metadata.get("name"))
+
+        attributes[classes.get(key, key)] = names
+
+def open_geometry(path):
+
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def read_geo_infos(path):
+    """ Read the header of a Houdini geometry file ( .geo, .bgeo, optionally
+        gzipped ) without Houdini. Return a dict formatted like the sidecars
+        geo_infos:
+            { "npoints", "nvertices", "nprims", "bounds", "center",
+              "attributes": { "point": [names], "vertex": [], ... } }
+        bounds ( xmin, xmax, ymin, ymax, zmin, zmax ) and center are None
+        when the file has no info block. The file is streamed, the topology
+        and attribute values are skipped, memory stays bounded whatever the
+        size of the geometry.
+        Raise ValueError if the file can't be parsed.
+    """
+    infos = {"npoints": 0, "nvertices": 0, "nprims": 0, "bounds": None,
+             "center": None, "attributes": {}}
+
+    with open_geometry(path) as f:
+
+        head = f.read(len(BINARY_MAGIC))
+        if head == BINARY_MAGIC:
+            reader = _BinaryReader(f)
+        else:
+            f.seek(0)
+            reader = _AsciiReader(f)
+
+        if reader.next()[0] != '[':
+            raise ValueError("Invalid geometry file: " + path)
+
+        counts = {"pointcount": "npoints", "vertexcount": "nvertices",
+                  "primitivecount": "nprims"}
+        while True:
+            event, key = reader.next()
+            if event == ']':
+                break
+
+            if key in counts:
+                infos[counts[key]] = _read_value(reader)
+            elif key == "info":
+                info = _read_value(reader)
+                bounds = info.get("bounds")
+                if bounds and len(bounds) == 6:
+                    infos["bounds"] = bounds
+                    infos["center"] = [(bounds[1] + bounds[0]) * 0.5,
+                                       (bounds[3] + bounds[2]) * 0.5,
+                                       (bounds[5] + bounds[4]) * 0.5]
+            elif key == "attributes":
+                infos["attributes"] = _read_attributes(reader)
+                # everything needed is read, primitives are not parsed
+                break
+            else:
+                _skip_value(reader)
+
+    return infos
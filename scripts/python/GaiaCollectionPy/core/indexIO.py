@@ -0,0 +1,1113 @@
+import os
+import re
+import json
+import heapq
+import bisect
+import base64
+import time
+import sqlite3
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from . import blobStore
+from . import snapshot
+from . import localCache
+from . import thumbnailPack
+
+INDEX_FILE = "collection.gaiadb"
+INDEX_VERSION = 6
+
+ASSET_COLUMNS = ("uid", "category", "name", "format", "sidecar", "metadata",
+                 "thumbnail", "mtime", "size", "inode",
+                 "npoints", "nprims", "size_x", "size_y", "size_z",
+                 "center_x", "center_y", "center_z", "file_size")
+_INSERT_ASSET = "INSERT OR REPLACE INTO assets({}) VALUES({})".format(
+    ','.join(ASSET_COLUMNS), ','.join('?' * len(ASSET_COLUMNS)))
+
+# geo_infos columns available for range queries and sorting, size_* are
+# the bounding box dimensions
+RANGE_FIELDS = ("npoints", "nprims", "size_x", "size_y", "size_z",
+                "center_x", "center_y", "center_z")
+
+# metadata fields indexed for search, with their query aliases
+SEARCH_FIELDS = ("name", "comment", "tags", "category", "created_by")
+SEARCH_ALIASES = {"tag": "tags", "by": "created_by", "user": "created_by"}
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+_THUMBNAIL_RE = re.compile(br'"thumbnail"\s*:\s*"')
+
+# drag and drop payload of collection assets: { "root": "", "uids": [] }
+ASSET_MIME_TYPE = "application/x-gaia-assets"
+
+# number of threads used to parse sidecars, below PARALLEL_MIN_FILES
+# changed sidecars they are parsed in the calling thread
+DEFAULT_WORKERS = 8
+PARALLEL_MIN_FILES = 16
+
+try:
+    _INDEXES
+except NameError:
+    # kept alive across reload() as the module namespace is reused
+    _INDEXES = {}
+
+def get_index(collection_root):
+    """ Return the CollectionIndex of the given collection root,
+        indexes are shared per root for the whole session.
+    """
+    key = os.path.normpath(collection_root)
+    index = _INDEXES.get(key)
+    if index is None:
+        index = CollectionIndex(collection_root)
+        _INDEXES[key] = index
+
+    return index
+
+def category_folder(collection_root, category):
+    """ Return the folder of a given category ( "/rocks" style ).
+    """
+    return collection_root + category.replace('/', os.sep)
+
+def geometry_path(collection_root, metadata):
+    """ Return the geometry file path of the given asset, either its blob
+        in the content-addressed store or the file next to its sidecar.
+    """
+    if metadata.get("blob"):
+        return blobStore.blob_path(collection_root, metadata["blob"])
+
+    return category_folder(collection_root, metadata["category"]) + os.sep + \
+           metadata["name"] + '.' + metadata["format"]
+
+def iter_categories(collection_root):
+    """ Walk the collection root and yield every category found
+        ( "/plants/trees" style ), hidden folders ( .blobs ) excluded.
+    """
+    root = os.path.normpath(collection_root)
+    for folder, dirs, _ in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if folder == root:
+            continue
+        yield folder[len(root):].replace(os.sep, '/')
+
+def encode_asset_refs(collection_root, uids):
+    """ Return the drag and drop payload ( ASSET_MIME_TYPE ) referencing
+        the given assets, the metadata isn't included.
+    """
+    return json.dumps({"root": collection_root, "uids": list(uids)}).encode("utf-8")
+
+def resolve_asset_refs(data):
+    """ Return the metadata of the assets referenced by the given drag and
+        drop payload, with their "collection_root" key set. Metadata are
+        read from the collection index in-memory cache.
+        Raise ValueError if the payload is invalid.
+    """
+    refs = json.loads(bytes(data).decode("utf-8"))
+    if not isinstance(refs, dict) or "root" not in refs or "uids" not in refs:
+        raise ValueError("Invalid asset references")
+
+    index = get_index(refs["root"])
+    items = []
+    for uid in refs["uids"]:
+        metadata = index.get_item(uid)
+        if metadata is None:
+            print("Warning: asset not found in collection: " + uid)
+            continue
+
+        metadata["collection_root"] = refs["root"]
+        items.append(metadata)
+
+    return items
+
+class SidecarRecord(dict):
+    """ Metadata read by read_metadata(): the small fields are parsed, the
+        inlined thumbnail is only located in the sidecar file. It is read
+        back from the file when accessed, either base64 encoded through
+        record["thumbnail"] / record.get("thumbnail") or decoded through
+        record.thumbnail().
+    """
+    __slots__ = ["path", "thumbnail_span"]
+
+    def __init__(self, path, fields, thumbnail_span=None):
+        super(SidecarRecord, self).__init__(fields)
+
+        self.path = path
+        self.thumbnail_span = thumbnail_span
+
+    def _read_thumbnail(self):
+
+        offset, length = self.thumbnail_span
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+
+        # the value can hold json escapes ( "\n" of base64.encodestring )
+        return json.loads(b'"' + data + b'"')
+
+    def thumbnail(self):
+        """ Return the raw jpg data of the inlined thumbnail, None if
+            the thumbnail isn't inlined.
+        """
+        if self.thumbnail_span is None:
+            return None
+
+        return base64.b64decode(self._read_thumbnail())
+
+    def __getitem__(self, key):
+
+        if key == "thumbnail" and self.thumbnail_span is not None:
+            return self._read_thumbnail()
+        return super(SidecarRecord, self).__getitem__(key)
+
+    def __contains__(self, key):
+
+        if key == "thumbnail":
+            return self.thumbnail_span is not None
+        return super(SidecarRecord, self).__contains__(key)
+
+    def get(self, key, default=None):
+
+        if key == "thumbnail" and self.thumbnail_span is not None:
+            return self._read_thumbnail()
+        return super(SidecarRecord, self).get(key, default)
+
+def read_metadata(path):
+    """ Lightweight sidecar reader: return a SidecarRecord with every
+        field but the inlined thumbnail, which is replaced by null before
+        parsing and only read when accessed.
+        Raise IOError or ValueError like json.load().
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    span = None
+    m = _THUMBNAIL_RE.search(data)
+    if m:
+        start = m.end()
+        # base64 has no quote, the first one closes the string
+        end = data.index(b'"', start)
+        span = (start, end - start)
+        data = data[:start - 1] + b"null" + data[end + 1:]
+
+    fields = json.loads(data.decode("utf-8"))
+    fields.pop("thumbnail", None)
+
+    return SidecarRecord(path, fields, span)
+
+def get_thumbnail(collection_root, metadata, level=None):
+    """ Return the raw jpg data of an asset thumbnail, either from the
+        metadata itself if inlined, from the collection thumbnail pack if
+        referenced or from the collection index.
+        If a level ( height in px ) is given the pre-scaled thumbnail is
+        returned when available, the full size one otherwise.
+    """
+    if level is not None:
+        pixdata = thumbnailPack.get_pack(collection_root, level).read(metadata["uid"])
+        if pixdata:
+            return pixdata
+
+    if isinstance(metadata, SidecarRecord) and "thumbnail" in metadata:
+        return metadata.thumbnail()
+
+    pixdata = metadata.get("thumbnail")
+    if pixdata:
+        return base64.b64decode(pixdata)
+
+    if metadata.get("thumbnail_ref"):
+        return thumbnailPack.get_pack(collection_root).read(metadata["uid"])
+
+    return get_index(collection_root).get_thumbnail(metadata["uid"])
+
+def _tokenize(text):
+
+    return _TOKEN_RE.findall(text.lower())
+
+def _asset_terms(metadata):
+    """ Return the ( term, uid, field ) rows of the search inverted index
+        for the given asset metadata.
+    """
+    uid = metadata["uid"]
+    terms = set()
+    for field in SEARCH_FIELDS:
+        value = metadata.get(field)
+        if not value:
+            continue
+
+        if not isinstance(value, list):
+            value = [value]
+
+        for v in value:
+            v = v.lower()
+            terms.add((v, field))
+            for t in _tokenize(v):
+                terms.add((t, field))
+
+    return [(t, uid, field) for t, field in terms]
+
+class CollectionIndex(object):
+    """ Persistent on-disk index ( sqlite ) of every asset's metadata found
+        under the collection root. Categories are indexed the first time
+        they are queried, rescan() then only re-parses the sidecars whose
+        fingerprint ( mtime, size, inode ) changed since last scan.
+
+        An inverted index ( terms table ) over name, comment, tags, category
+        and created_by is maintained along the assets, it is loaded in memory
+        on first search, see search().
+
+        Metadata are stored without their thumbnail, inlined thumbnails ( not
+        yet migrated to the thumbnail pack ) are kept in their own blob column
+        and only read through get_thumbnail().
+
+        After every update the index is compiled to a memory mapped snapshot
+        ( collection.gaiacr ), categories and metadata are read from it while
+        it matches the index file, see write_snapshot().
+    """
+    def __init__(self, collection_root):
+
+        self.collection_root = collection_root
+        self.db_path = collection_root + os.sep + INDEX_FILE
+
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._search = None
+        # uid: metadata, filled by get_items() and get_item()
+        self._metadata = {}
+        self._init_db()
+
+        self.snapshot_path = collection_root + os.sep + snapshot.SNAPSHOT_FILE
+        # None until opened, False if missing or outdated
+        self._snapshot = None
+
+    def _connect(self):
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            self._local.conn = conn
+
+        return conn
+
+    def _init_db(self):
+
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == INDEX_VERSION:
+            # left untouched, the snapshot is only valid while the index
+            # file isn't modified
+            return
+
+        # the index is only a cache of the sidecars, outdated
+        # schemas are dropped and rebuilt on demand
+        conn.executescript("""DROP TABLE IF EXISTS assets;
+                              DROP TABLE IF EXISTS categories;
+                              DROP TABLE IF EXISTS folders;
+                              DROP TABLE IF EXISTS terms;
+                              DROP TABLE IF EXISTS hashes;""")
+
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS assets(
+                uid TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                name TEXT,
+                format TEXT,
+                sidecar TEXT,
+                metadata TEXT,
+                thumbnail BLOB,
+                mtime REAL,
+                size INTEGER,
+                inode INTEGER,
+                npoints INTEGER,
+                nprims INTEGER,
+                size_x REAL,
+                size_y REAL,
+                size_z REAL,
+                center_x REAL,
+                center_y REAL,
+                center_z REAL,
+                file_size INTEGER);
+            CREATE INDEX IF NOT EXISTS assets_category ON assets(category);
+            CREATE INDEX IF NOT EXISTS assets_sidecar ON assets(sidecar);
+            CREATE INDEX IF NOT EXISTS assets_npoints ON assets(npoints);
+            CREATE INDEX IF NOT EXISTS assets_nprims ON assets(nprims);
+            CREATE INDEX IF NOT EXISTS assets_size_x ON assets(size_x);
+            CREATE INDEX IF NOT EXISTS assets_size_y ON assets(size_y);
+            CREATE INDEX IF NOT EXISTS assets_size_z ON assets(size_z);
+            CREATE TABLE IF NOT EXISTS categories(
+                category TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS folders(
+                category TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS terms(
+                term TEXT NOT NULL,
+                uid TEXT NOT NULL,
+                field TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS terms_term ON terms(term, field);
+            CREATE INDEX IF NOT EXISTS terms_uid ON terms(uid);
+            CREATE TABLE IF NOT EXISTS hashes(
+                uid TEXT PRIMARY KEY,
+                dhash INTEGER);
+            PRAGMA user_version = {};""".format(INDEX_VERSION))
+        conn.commit()
+
+    def _row_from_metadata(self, metadata, sidecar, stat=None):
+
+        if isinstance(metadata, SidecarRecord):
+            thumbnail = metadata.thumbnail()
+        else:
+            thumbnail = metadata.get("thumbnail")
+            if thumbnail:
+                thumbnail = base64.b64decode(thumbnail)
+
+        if thumbnail:
+            thumbnail = sqlite3.Binary(thumbnail)
+
+        metadata = dict(metadata)
+        metadata.pop("thumbnail", None)
+
+        if stat is None:
+            stat = os.stat(sidecar)
+
+        # geo infos columns, None when missing
+        geo_infos = metadata.get("geo_infos") or {}
+        bounds = geo_infos.get("bounds") or [None] * 6
+        center = geo_infos.get("center") or [None] * 3
+        sizes = [None] * 3
+        if None not in bounds:
+            sizes = [bounds[1] - bounds[0], bounds[3] - bounds[2],
+                     bounds[5] - bounds[4]]
+
+        # size of the geometry file, aggregated per category
+        if metadata.get("blob"):
+            geo_path = blobStore.blob_path(self.collection_root, metadata["blob"])
+        else:
+            geo_path = os.path.dirname(sidecar) + os.sep + \
+                       metadata["name"] + '.' + metadata["format"]
+        try:
+            file_size = os.path.getsize(geo_path)
+        except OSError:
+            file_size = None
+
+        return (metadata["uid"], metadata["category"], metadata["name"],
+                metadata["format"], sidecar, json.dumps(metadata), thumbnail,
+                stat.st_mtime, stat.st_size, stat.st_ino,
+                geo_infos.get("npoints"), geo_infos.get("nprims"),
+                sizes[0], sizes[1], sizes[2], center[0], center[1], center[2],
+                file_size)
+
+    def _insert(self, conn, items):
+        """ Insert or replace the given ( metadata, sidecar, stat ) items,
+            assets rows and search terms.
+        """
+        rows = []
+        terms = []
+        for metadata, sidecar, stat in items:
+            rows.append(self._row_from_metadata(metadata, sidecar, stat))
+            terms.extend(_asset_terms(metadata))
+
+        conn.executemany("DELETE FROM terms WHERE uid=?",
+                         [(r[0],) for r in rows])
+        # the thumbnail may have changed, hashed again on demand
+        conn.executemany("DELETE FROM hashes WHERE uid=?",
+                         [(r[0],) for r in rows])
+        conn.executemany(_INSERT_ASSET, rows)
+        conn.executemany("INSERT INTO terms VALUES(?,?,?)", terms)
+
+        with self._lock:
+            for metadata, _, _ in items:
+                self._metadata.pop(metadata["uid"], None)
+                if self._search is not None:
+                    self._search.add(metadata)
+
+    def _delete(self, conn, where, args):
+        """ Delete the assets matching the given where clause, with
+            their search terms.
+        """
+        uids = [r[0] for r in conn.execute("SELECT uid FROM assets WHERE " + where,
+                                           args)]
+        with self._lock:
+            for uid in uids:
+                self._metadata.pop(uid, None)
+                if self._search is not None:
+                    self._search.remove(uid)
+
+        conn.execute(("DELETE FROM terms WHERE uid IN "
+                      "(SELECT uid FROM assets WHERE " + where + ")"), args)
+        conn.execute(("DELETE FROM hashes WHERE uid IN "
+                      "(SELECT uid FROM assets WHERE " + where + ")"), args)
+        conn.execute("DELETE FROM assets WHERE " + where, args)
+
+    def _get_snapshot(self):
+        """ Return the snapshot if it matches the index file, None otherwise.
+            Must be called with the lock held.
+        """
+        if self._snapshot is None:
+            # mapped from the local cache when the collection is remote
+            path = localCache.local_path(self.snapshot_path, recheck=True) \
+                   if os.path.exists(self.snapshot_path) else self.snapshot_path
+            self._snapshot = snapshot.open_snapshot(path) or False
+            if self._snapshot:
+                for level, (_, table_size) in self._snapshot.packs.items():
+                    pack = thumbnailPack.get_pack(self.collection_root, level)
+                    pack.set_snapshot(lambda uid, level=level: \
+                                      self._thumbnail_span(uid, level), table_size)
+
+        if self._snapshot and not self._snapshot.matches(self.db_path):
+            # updated by another session meanwhile
+            self._close_snapshot()
+            self._snapshot = False
+
+        return self._snapshot or None
+
+    def _close_snapshot(self):
+        """ Packs keep their snapshot spans, _thumbnail_span() returns None
+            until the next snapshot is opened.
+        """
+        if self._snapshot:
+            self._snapshot.close()
+        self._snapshot = None
+
+    def _thumbnail_span(self, uid, level):
+
+        with self._lock:
+            if not self._snapshot:
+                return None
+            return self._snapshot.thumbnail_span(uid, level)
+
+    def write_snapshot(self):
+        """ Compile the index to the snapshot file: categories tree, assets
+            metadata and thumbnail offsets. Opening the collection then only
+            maps this file.
+        """
+        conn = self._connect()
+        categories = dict((r[0], False) for r in conn.execute(
+            "SELECT category FROM folders"))
+        for r in conn.execute("SELECT category FROM categories"):
+            categories[r[0]] = True
+
+        assets = conn.execute(("SELECT uid, category, npoints, nprims, file_size, "
+                               "metadata FROM assets ORDER BY category, name")).fetchall()
+
+        packs = []
+        for level in [None] + thumbnailPack.list_levels(self.collection_root):
+            offsets, table_size = thumbnailPack.get_pack(self.collection_root,
+                                                         level).table_state()
+            packs.append((level, table_size, offsets))
+
+        with self._lock:
+            # the mapped file can't be replaced on Windows
+            self._close_snapshot()
+            try:
+                snapshot.write(self.snapshot_path, os.stat(self.db_path),
+                               categories, assets, packs)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                print("Warning: can't write collection snapshot: {}".format(e))
+
+    def _read_sidecar(self, sidecar):
+
+        try:
+            return read_metadata(sidecar)
+        except (IOError, ValueError):
+            print("Warning: invalid metadata file: " + sidecar)
+            return None
+
+    def is_indexed(self, category):
+
+        with self._lock:
+            snap = self._get_snapshot()
+            if snap is not None:
+                return snap.is_indexed(category)
+
+        conn = self._connect()
+        r = conn.execute("SELECT 1 FROM categories WHERE category=?",
+                         (category,)).fetchone()
+        return r is not None
+
+    def refresh(self, category, workers=DEFAULT_WORKERS):
+        """ Force a re-parse of every sidecar of the given category.
+            Return the number of indexed assets.
+        """
+        conn = self._connect()
+        with conn:
+            self._delete(conn, "category=?", (category,))
+
+        self.rescan(category, workers, force_snapshot=True)
+        return self.count(category)
+
+    def rescan(self, category, workers=DEFAULT_WORKERS, force_snapshot=False):
+        """ Incremental update of the given category: sidecars are stat'ed and
+            compared to their stored fingerprint, only added or changed ones
+            are parsed, concurrently by a pool of "workers" threads.
+            Return the delta as a dict of uid lists, with the parsing stats:
+            { "added": [], "modified": [], "removed": [],
+              "stats": { "files": n, "bytes": n, "elapsed": seconds } }
+        """
+        start = time.time()
+        delta = {"added": [], "modified": [], "removed": []}
+        conn = self._connect()
+        indexed = self.is_indexed(category)
+
+        known = {}
+        for uid, sidecar, mtime, size, inode in conn.execute(
+                ("SELECT uid, sidecar, mtime, size, inode FROM assets "
+                 "WHERE category=?"), (category,)):
+            known[sidecar] = (uid, (mtime, size, inode))
+
+        folder = category_folder(self.collection_root, category)
+        files = []
+        if os.path.isdir(folder):
+            files = [f for f in os.listdir(folder) if f.endswith(".json")]
+
+        changed = []
+        seen = set()
+        for f in files:
+
+            sidecar = folder + os.sep + f
+            try:
+                stat = os.stat(sidecar)
+            except OSError:
+                continue
+
+            seen.add(sidecar)
+            entry = known.get(sidecar)
+            if entry and entry[1] == (stat.st_mtime, stat.st_size, stat.st_ino):
+                continue
+
+            changed.append((sidecar, stat, entry))
+
+        paths = [c[0] for c in changed]
+        if workers > 1 and len(paths) >= PARALLEL_MIN_FILES:
+            pool = ThreadPool(min(workers, len(paths)))
+            try:
+                # imap keeps the files order
+                parsed = list(pool.imap(self._read_sidecar, paths, chunksize=4))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            parsed = [self._read_sidecar(p) for p in paths]
+
+        items = []
+        nbytes = 0
+        for (sidecar, stat, entry), metadata in zip(changed, parsed):
+
+            nbytes += stat.st_size
+            if not isinstance(metadata, dict) or not all(k in metadata for k in \
+                   ("uid", "category", "name", "format")):
+                if metadata is not None:
+                    print("Warning: invalid metadata file: " + sidecar)
+                continue
+
+            items.append((metadata, sidecar, stat))
+
+            if entry:
+                delta["modified"].append(metadata["uid"])
+            else:
+                delta["added"].append(metadata["uid"])
+
+        removed = [s for s in known if s not in seen]
+        delta["removed"] = [known[s][0] for s in removed]
+
+        with conn:
+            for s in removed:
+                self._delete(conn, "sidecar=?", (s,))
+            self._insert(conn, items)
+            conn.execute("INSERT OR IGNORE INTO categories VALUES(?)",
+                         (category,))
+
+        if force_snapshot or not indexed or items or removed:
+            self.write_snapshot()
+
+        delta["stats"] = {"files": len(changed), "bytes": nbytes,
+                          "elapsed": time.time() - start}
+        return delta
+
+    def add_item(self, metadata, sidecar):
+        """ Add or update a single asset, used when an asset is published.
+        """
+        conn = self._connect()
+        with conn:
+            self._insert(conn, [(metadata, sidecar, os.stat(sidecar))])
+        self.write_snapshot()
+
+    def add_items(self, items):
+        """ Add or update a batch of ( metadata, sidecar ) assets in a
+            single transaction, used by bulk ingest.
+        """
+        conn = self._connect()
+        with conn:
+            self._insert(conn, [(m, s, os.stat(s)) for m, s in items])
+        self.write_snapshot()
+
+    def remove_item(self, uid):
+
+        conn = self._connect()
+        with conn:
+            self._delete(conn, "uid=?", (uid,))
+        self.write_snapshot()
+
+    def get_items(self, category):
+        """ Return the metadata of every asset of the given category
+            ( without thumbnail ), the category is indexed if needed.
+        """
+        if not self.is_indexed(category):
+            self.rescan(category)
+
+        with self._lock:
+            snap = self._get_snapshot()
+            items = snap.get_items(category) if snap is not None else None
+
+        if items is None:
+            conn = self._connect()
+            rows = conn.execute(("SELECT metadata FROM assets WHERE category=? "
+                                 "ORDER BY name"), (category,))
+            items = [json.loads(r[0]) for r in rows]
+
+        with self._lock:
+            for metadata in items:
+                self._metadata[metadata["uid"]] = metadata
+
+        # callers are free to modify their copy
+        return [dict(m) for m in items]
+
+    def get_item(self, uid):
+        """ Return the metadata of the given asset uid, None if not found.
+            Metadata are cached in memory.
+        """
+        with self._lock:
+            metadata = self._metadata.get(uid)
+            if metadata is None:
+                snap = self._get_snapshot()
+                if snap is not None:
+                    metadata = snap.get_item(uid)
+                    if metadata is None:
+                        return None
+                    self._metadata[uid] = metadata
+        if metadata is not None:
+            return dict(metadata)
+
+        conn = self._connect()
+        r = conn.execute("SELECT metadata FROM assets WHERE uid=?",
+                         (uid,)).fetchone()
+        if r is None:
+            return None
+
+        metadata = json.loads(r[0])
+        with self._lock:
+            self._metadata[uid] = metadata
+
+        return dict(metadata)
+
+    def get_thumbnail(self, uid):
+        """ Return the raw jpg data of the thumbnail of the given asset uid,
+            None if not found.
+        """
+        conn = self._connect()
+        r = conn.execute("SELECT thumbnail FROM assets WHERE uid=?",
+                         (uid,)).fetchone()
+        if r is None or r[0] is None:
+            return thumbnailPack.get_pack(self.collection_root).read(uid)
+
+        return bytes(r[0])
+
+    def sidecars(self, category):
+        """ Return the sidecar paths of the indexed assets of the given
+            category.
+        """
+        conn = self._connect()
+        return [r[0] for r in conn.execute(
+            "SELECT sidecar FROM assets WHERE category=?", (category,))]
+
+    def unhashed_uids(self):
+        """ Return the uids of the indexed assets without thumbnail
+            hash, see duplicates.compute_hashes().
+        """
+        conn = self._connect()
+        return [r[0] for r in conn.execute(
+            "SELECT uid FROM assets WHERE uid NOT IN (SELECT uid FROM hashes)")]
+
+    def set_hashes(self, hashes):
+        """ Store the given ( uid, 64 bits thumbnail hash ) pairs.
+        """
+        # sqlite integers are signed
+        rows = [(uid, h - (1 << 64) if h >= (1 << 63) else h) for uid, h in hashes]
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO hashes VALUES(?,?)", rows)
+        self.write_snapshot()
+
+    def get_hashes(self):
+        """ Return { uid: thumbnail hash } of the hashed assets.
+        """
+        conn = self._connect()
+        return dict((r[0], r[1] & 0xFFFFFFFFFFFFFFFF) for r in conn.execute(
+            "SELECT uid, dhash FROM hashes"))
+
+    def count(self, category):
+
+        conn = self._connect()
+        return conn.execute("SELECT COUNT(*) FROM assets WHERE category=?",
+                            (category,)).fetchone()[0]
+
+    def list_categories(self, rescan=False):
+        """ Return every category of the collection, sorted. The folders
+            are only walked the first time or when rescan is True, the list
+            is kept in the index otherwise.
+        """
+        if not rescan:
+            with self._lock:
+                snap = self._get_snapshot()
+                categories = snap.list_categories() if snap is not None else None
+            if categories:
+                return categories
+
+        conn = self._connect()
+        categories = [r[0] for r in conn.execute(
+            "SELECT category FROM folders ORDER BY category")]
+
+        if rescan or not categories:
+            folders = sorted(iter_categories(self.collection_root))
+            if folders != categories:
+                categories = folders
+                with conn:
+                    conn.execute("DELETE FROM folders")
+                    conn.executemany("INSERT OR IGNORE INTO folders VALUES(?)",
+                                     [(c,) for c in categories])
+                self.write_snapshot()
+
+        return categories
+
+    def category_stats(self):
+        """ Return { category: ( assets count, geometry files size ) } of
+            the indexed categories.
+        """
+        with self._lock:
+            snap = self._get_snapshot()
+            if snap is not None:
+                return snap.category_stats()
+
+        conn = self._connect()
+        stats = dict((r[0], (0, 0)) for r in conn.execute(
+            "SELECT category FROM categories"))
+        for category, count, nbytes in conn.execute(
+                ("SELECT category, COUNT(*), TOTAL(file_size) FROM assets "
+                 "GROUP BY category")):
+            stats[category] = (count, int(nbytes))
+
+        return stats
+
+    def index_all(self, workers=DEFAULT_WORKERS):
+        """ Index every category of the collection not indexed yet, needed
+            before searching the whole collection. Categories come from the
+            index, nothing is read from disk once they are all indexed, the
+            collection watcher keeps them up to date.
+        """
+        for category in self.list_categories():
+            if not self.is_indexed(category):
+                self.rescan(category, workers)
+
+    def query(self, filters=None, category=None, order_by="name",
+              descending=False, limit=None):
+        """ Range query over the geo_infos columns, return the matching
+            metadata. filters is a dict of { field: ( min, max ) }, None
+            leaving a bound open, e.g. assets under 2 units tall with less
+            than 5k prims:
+                query({"size_y": (None, 2.0), "nprims": (None, 5000)},
+                      order_by="nprims")
+            Fields are the ones of RANGE_FIELDS, bounds are inclusive.
+            category restricts the query to a category and its children.
+        """
+        where = []
+        args = []
+        for field, (_min, _max) in (filters or {}).items():
+            if field not in RANGE_FIELDS:
+                raise ValueError("Invalid range field: " + field)
+            if _min is not None:
+                where.append(field + " >= ?")
+                args.append(_min)
+            if _max is not None:
+                where.append(field + " <= ?")
+                args.append(_max)
+
+        if category:
+            where.append("(category = ? OR category LIKE ?)")
+            args.extend([category, category + "/%"])
+
+        if order_by not in RANGE_FIELDS + ("name", "category"):
+            raise ValueError("Invalid sort field: " + order_by)
+
+        sql = "SELECT metadata FROM assets"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + order_by + (" DESC" if descending else "")
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+
+        conn = self._connect()
+        return [json.loads(r[0]) for r in conn.execute(sql, args)]
+
+    def _search_index(self):
+
+        if self._search is None:
+            self._search = SearchIndex()
+            conn = self._connect()
+            self._search.load(conn.execute(("SELECT uid, name, category FROM assets "
+                                            "ORDER BY name")),
+                              conn.execute("SELECT term, uid, field FROM terms"))
+
+        return self._search
+
+    def search(self, query, category=None, limit=1000):
+        """ Search the indexed assets, return the matching metadata sorted
+            by name. Query syntax:
+                rock tree        both words ( AND )
+                rock OR bush     either words, AND binds tighter than OR
+                -dead, NOT dead  exclude word
+                roc*             prefix match
+                tag:placeholder  restrict to a field ( name, comment, tag(s),
+                                 category, created_by / by )
+            category restricts the search to a category and its children.
+            The query runs on the in-memory inverted index, only the
+            metadata of the returned assets are read from the index.
+        """
+        with self._lock:
+            uids = self._search_index().search(query, category, limit)
+
+        if not uids:
+            return []
+
+        conn = self._connect()
+        metadata = {}
+        # sqlite limits the number of host parameters of a statement
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i + 500]
+            sql = ("SELECT uid, metadata FROM assets WHERE uid IN (" +
+                   ','.join('?' * len(chunk)) + ")")
+            for uid, m in conn.execute(sql, chunk):
+                metadata[uid] = m
+
+        return [json.loads(metadata[uid]) for uid in uids if uid in metadata]
+
+class SearchIndex(object):
+    """ In-memory inverted index of the collection: posting sets of integer
+        doc ids per field and term ( and for all fields, under "*" ), plus a
+        sorted vocabulary per field for prefix queries. Loaded from the terms
+        table of the CollectionIndex and kept up to date by the index writes
+        of the session.
+
+        Doc ids are given in name order at load time so results can be sorted
+        as plain integers, as long as no asset is added afterward. Removed
+        assets are only flagged, posting sets are rebuilt when too many stale
+        doc ids accumulate.
+
+        With prefix_len > 0 the doc ids of every term prefix up to prefix_len
+        characters are kept too, short prefix queries ( typed as you go ) are
+        then a single lookup instead of the union of many posting sets.
+    """
+    def __init__(self, prefix_len=0):
+
+        self.uids = []
+        self.names = []
+        self.categories = []
+        self.docs = {}
+        self.removed = set()
+        self.ordered = True
+        self.fields = SEARCH_FIELDS + ("*",)
+        self.postings = dict((f, {}) for f in self.fields)
+        self.vocabulary = dict((f, []) for f in self.fields)
+        self.prefix_len = prefix_len
+        self.prefixes = dict((f, {}) for f in self.fields)
+
+    def _add_posting(self, field, term, doc):
+        """ Return True if term is new for this field.
+        """
+        new_term = False
+        postings = self.postings[field]
+        p = postings.get(term)
+        if p is None:
+            p = postings[term] = set()
+            new_term = True
+        p.add(doc)
+
+        if self.prefix_len:
+            prefixes = self.prefixes[field]
+            for i in range(1, min(len(term), self.prefix_len) + 1):
+                p = prefixes.get(term[:i])
+                if p is None:
+                    p = prefixes[term[:i]] = set()
+                p.add(doc)
+
+        return new_term
+
+    def load(self, assets, terms):
+
+        for uid, name, category in assets:
+            self._add_doc(uid, name, category)
+
+        docs = self.docs
+        for term, uid, field in terms:
+            doc = docs.get(uid)
+            if doc is None:
+                continue
+            self._add_posting(field, term, doc)
+            self._add_posting("*", term, doc)
+
+        for field in self.fields:
+            self.vocabulary[field] = sorted(self.postings[field])
+
+    def load_items(self, items):
+        """ Load the given list of metadata instead of the terms table,
+            e.g. to filter the displayed items.
+        """
+        terms = []
+        for metadata in items:
+            terms.extend(_asset_terms(metadata))
+
+        self.load([(m["uid"], m["name"], m["category"]) for m in items], terms)
+
+    def _add_doc(self, uid, name, category):
+
+        doc = len(self.uids)
+        name = name.lower()
+        if self.names and name < self.names[-1]:
+            self.ordered = False
+
+        self.uids.append(uid)
+        self.names.append(name)
+        self.categories.append(category)
+        self.docs[uid] = doc
+        return doc
+
+    def add(self, metadata):
+
+        self.remove(metadata["uid"])
+        doc = self._add_doc(metadata["uid"], metadata["name"],
+                            metadata["category"])
+
+        for term, _, field in _asset_terms(metadata):
+            for f in (field, "*"):
+                if self._add_posting(f, term, doc):
+                    bisect.insort(self.vocabulary[f], term)
+
+    def remove(self, uid):
+
+        doc = self.docs.pop(uid, None)
+        if doc is None:
+            return
+
+        self.removed.add(doc)
+        if len(self.removed) > 1000 and len(self.removed) * 4 > len(self.uids):
+            self._compact()
+
+    def _compact(self):
+
+        removed = self.removed
+        self.removed = set()
+        for field in self.fields:
+            for postings in (self.postings[field], self.prefixes[field]):
+                for term in list(postings):
+                    p = postings[term] - removed
+                    if p:
+                        postings[term] = p
+                    else:
+                        del postings[term]
+            self.vocabulary[field] = sorted(self.postings[field])
+
+    def _match_word(self, word):
+        """ Return the doc ids set matching a single query word:
+            "term", "prefix*" or "field:term".
+        """
+        field = "*"
+        if ':' in word:
+            field, word = word.split(':', 1)
+            field = SEARCH_ALIASES.get(field, field)
+            if field not in SEARCH_FIELDS:
+                raise ValueError("Invalid search field: " + field)
+
+        word = word.lower()
+        postings = self.postings[field]
+        if not word.endswith('*'):
+            return postings.get(word, set())
+
+        prefix = word[:-1]
+        if not prefix:
+            return set(self.docs.values())
+
+        if len(prefix) <= self.prefix_len:
+            return self.prefixes[field].get(prefix, set())
+
+        vocabulary = self.vocabulary[field]
+        i = bisect.bisect_left(vocabulary, prefix)
+        j = bisect.bisect_left(vocabulary, prefix + u"\uffff", i)
+
+        return set().union(*[postings[t] for t in vocabulary[i:j]])
+
+    def match(self, query):
+        """ Return the set of doc ids matching the given query, unsorted.
+            See CollectionIndex.search() for the query syntax.
+        """
+        groups = [[]]
+        negate = False
+        for word in query.split():
+            if word == "OR":
+                groups.append([])
+                continue
+            if word == "NOT":
+                negate = True
+                continue
+            if word.startswith('-') and len(word) > 1:
+                negate = True
+                word = word[1:]
+            groups[-1].append((word, negate))
+            negate = False
+
+        # posting sets are never modified in place, only combined
+        result = None
+        for group in groups:
+            if not group:
+                continue
+
+            # smallest sets first to keep the intersections cheap
+            positives = sorted([self._match_word(w) for w, n in group if not n],
+                               key=len)
+            if positives:
+                matches = positives[0]
+                for p in positives[1:]:
+                    matches = matches & p
+            else:
+                matches = set(self.docs.values())
+
+            for w, n in group:
+                if n:
+                    matches = matches - self._match_word(w)
+
+            result = matches if result is None else result | matches
+
+        if not result:
+            return set()
+
+        if self.removed:
+            result = result - self.removed
+
+        return result
+
+    def search(self, query, category=None, limit=1000):
+        """ Return the uids matching the given query, sorted by name.
+            See CollectionIndex.search() for the query syntax.
+        """
+        result = self.match(query)
+        if not result:
+            return []
+
+        if category:
+            sub = category + '/'
+            cats = self.categories
+            result = [d for d in result if cats[d] == category \
+                      or cats[d].startswith(sub)]
+
+        key = None if self.ordered else self.names.__getitem__
+        if len(result) > limit:
+            docs = heapq.nsmallest(limit, result, key=key)
+        else:
+            docs = sorted(result, key=key)
+
+        return [self.uids[d] for d in docs]
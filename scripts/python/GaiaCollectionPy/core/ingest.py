@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import shutil
+import getpass
+import hashlib
+import argparse
+import datetime
+import multiprocessing
+
+from . import geoIO
+from . import blobStore
+from . import indexIO
+from . import thumbnailPack
+
+# formats geoIO can read without Houdini
+GEO_FORMATS = ("bgeo.gz", "bgeo", "geo.gz", "geo")
+
+def split_format(file_name):
+    """ Return ( name, format ) of the given geometry file name,
+        format is None if not supported.
+    """
+    for fmt in GEO_FORMATS:
+        if file_name.endswith("." + fmt):
+            return file_name[:-len(fmt) - 1], fmt
+
+    return file_name, None
+
+def iter_geometries(source):
+    """ Yield ( path, tags ) of every supported geometry file found
+        in source, sub folder names are used as tags.
+    """
+    for folder, _, files in os.walk(source):
+
+        rel = os.path.relpath(folder, source)
+        tags = [] if rel == os.curdir else [t for t in rel.split(os.sep) if t]
+
+        for f in sorted(files):
+            if split_format(f)[1]:
+                yield folder + os.sep + f, tags
+
+def write_sidecar(sidecar, metadata):
+    """ Write metadata to a temp file first then move it, a failure must
+        not leave a half written sidecar.
+    """
+    tmp = sidecar + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(metadata, f, indent=4)
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+    os.rename(tmp, sidecar)
+
+def _ingest_file(job):
+    """ Process pool worker, must stay a top level function.
+        Copy one geometry file to its category folder and write its
+        sidecar. Return ( status, payload ), status is "ok" with
+        ( metadata, sidecar ), "skipped" or "error" with a message.
+        blob_root is the collection root when its content-addressed store
+        is used, None otherwise.
+    """
+    path, tags, category, folder, obj_type, user, overwrite, blob_root = job
+
+    name, fmt = split_format(os.path.basename(path))
+    sidecar = folder + os.sep + name + ".json"
+    if os.path.exists(sidecar) and not overwrite:
+        return "skipped", sidecar
+
+    try:
+        infos = geoIO.read_geo_infos(path)
+    except (IOError, EOFError, ValueError) as e:
+        return "error", "{}: {}".format(path, e)
+
+    metadata = {}
+    metadata["creation_time"] = str(datetime.datetime.now())
+    metadata["created_by"] = user
+    metadata["category"] = category
+    metadata["type"] = obj_type
+    metadata["format"] = fmt
+    metadata["name"] = name
+    metadata["comment"] = "Ingested from " + path
+    metadata["tags"] = tags
+
+    geo_infos = {}
+    for k in ("npoints", "nprims", "bounds", "center"):
+        geo_infos[k] = infos[k]
+    metadata["geo_infos"] = geo_infos
+
+    metadata["path"] = "%ROOT%" + category
+    metadata["uid"] = hashlib.sha1((category + os.sep + name).encode("utf-8")).hexdigest()
+
+    try:
+        if blob_root:
+            metadata["blob"] = blobStore.store(blob_root, path, fmt)
+        else:
+            shutil.copyfile(path, folder + os.sep + name + "." + fmt)
+        write_sidecar(sidecar, metadata)
+    except (IOError, OSError) as e:
+        return "error", "{}: {}".format(path, e)
+
+    return "ok", (metadata, sidecar)
+
+def ingest_directory(collection_root, source, category, tags=None,
+                     obj_type="static", processes=None, overwrite=False,
+                     content_store=None):
+    """ Publish every geometry file ( .bgeo, .geo, optionally gzipped ) found
+        in source to the given category of the collection, without Houdini.
+        Files are parsed and sidecars written concurrently by a process pool,
+        the collection index is then updated in a single transaction.
+        Thumbnails are not created, see thumbnail_pass().
+        Geometry goes to the content-addressed store when content_store is
+        True, or when None and the store is enabled on the collection.
+        Inside an interactive Houdini session use processes=1 ( or run it
+        through hython ), the pool can't spawn the houdini executable.
+        Return a stats dict: { "ingested", "skipped", "errors", "elapsed" }
+    """
+    start = time.time()
+    tags = list(tags or [])
+
+    folder = indexIO.category_folder(collection_root, category)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    if content_store is None:
+        content_store = blobStore.is_enabled(collection_root)
+    elif content_store:
+        blobStore.enable(collection_root)
+    blob_root = collection_root if content_store else None
+
+    user = getpass.getuser()
+    jobs = [(path, tags + [t for t in sub_tags if t not in tags], category,
+             folder, obj_type, user, overwrite, blob_root)
+            for path, sub_tags in iter_geometries(source)]
+
+    # several files can share the same asset name ( rock.bgeo / rock.geo )
+    names = set()
+    unique_jobs = []
+    for job in jobs:
+        name = split_format(os.path.basename(job[0]))[0]
+        if name in names:
+            print("Warning: duplicated asset name, ignored: " + job[0])
+            continue
+        names.add(name)
+        unique_jobs.append(job)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes > 1 and len(unique_jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(unique_jobs)))
+        try:
+            results = list(pool.imap_unordered(_ingest_file, unique_jobs,
+                                               chunksize=8))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_ingest_file(j) for j in unique_jobs]
+
+    items = []
+    stats = {"ingested": 0, "skipped": 0, "errors": 0}
+    for status, payload in results:
+        if status == "ok":
+            items.append(payload)
+            stats["ingested"] += 1
+        elif status == "skipped":
+            stats["skipped"] += 1
+        else:
+            print("Warning: can't ingest " + payload)
+            stats["errors"] += 1
+
+    if items:
+        indexIO.get_index(collection_root).add_items(items)
+
+    stats["elapsed"] = time.time() - start
+    return stats
+
+def thumbnail_pass(collection_root, category, render, overwrite=False):
+    """ Create the thumbnails of the given category assets, pre-scaled
+        levels included, typically after a bulk ingest.
+        render( metadata, geo_path ) must return the jpg data or None, assets
+        already in the thumbnail pack are skipped unless overwrite is True.
+        Return the number of created thumbnails.
+    """
+    # needs Qt, only imported when thumbnails are created
+    from . import mipmaps
+
+    pack = thumbnailPack.get_pack(collection_root)
+    index = indexIO.get_index(collection_root)
+    folder = indexIO.category_folder(collection_root, category)
+
+    items = []
+    for metadata in index.get_items(category):
+
+        if metadata["uid"] in pack and not overwrite:
+            continue
+
+        geo_path = indexIO.geometry_path(collection_root, metadata)
+        data = render(metadata, geo_path)
+        if not data:
+            continue
+
+        pack.write(metadata["uid"], data)
+        mipmaps.write_levels(collection_root, metadata["uid"], data)
+        metadata["thumbnail_ref"] = thumbnailPack.PACK_REF
+
+        sidecar = folder + os.sep + metadata["name"] + ".json"
+        write_sidecar(sidecar, metadata)
+        items.append((metadata, sidecar))
+
+    if items:
+        index.add_items(items)
+
+    return len(items)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python -m GaiaCollectionPy.core.ingest",
+                                     description="Bulk publish of a geometry folder")
+    parser.add_argument("collection_root")
+    parser.add_argument("source")
+    parser.add_argument("category", help='e.g. "/rocks/cliffs"')
+    parser.add_argument("--tags", default="", help='";" separated tags')
+    parser.add_argument("--type", default="static",
+                        choices=["static", "dynamic", "animated"])
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--content-store", action="store_true", default=None,
+                        help="store geometry in the deduplicated blob store")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print("Invalid source folder: " + args.source)
+        sys.exit(1)
+
+    tags = [s.replace(' ', '') for s in args.tags.split(';') if s.strip()]
+    stats = ingest_directory(args.collection_root, args.source, args.category,
+                             tags=tags, obj_type=args.type,
+                             processes=args.processes, overwrite=args.overwrite,
+                             content_store=args.content_store)
+
+    print("{ingested} asset(s) ingested, {skipped} skipped, {errors} error(s) "
+          "in {elapsed:.2f}s".format(**stats))
@@ -0,0 +1,349 @@
+import os
+import re
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+
+# the local cache is enabled by setting GAIA_LOCAL_CACHE to a local folder,
+# GAIA_LOCAL_CACHE_MB caps its size
+CACHE_ENV = "GAIA_LOCAL_CACHE"
+CACHE_SIZE_ENV = "GAIA_LOCAL_CACHE_MB"
+DEFAULT_MAX_MB = 10 * 1024
+
+CACHE_DB = "cache.gaiadb"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# blob store files are named after the sha1 of their content
+_BLOB_NAME_RE = re.compile(r"^([0-9a-f]{40})\.")
+
+try:
+    _CACHE
+except NameError:
+    _CACHE = None
+
+def get_cache():
+    """ Return the local cache of the session, None if GAIA_LOCAL_CACHE
+        isn't set.
+    """
+    global _CACHE
+    cache_root = os.environ.get(CACHE_ENV)
+    if not cache_root:
+        return None
+
+    if _CACHE is None or _CACHE.cache_root != cache_root:
+        try:
+            max_mb = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_MAX_MB))
+        except ValueError:
+            max_mb = DEFAULT_MAX_MB
+        _CACHE = LocalCache(cache_root, max_mb * 1024 * 1024)
+
+    return _CACHE
+
+def local_path(path, pin=False, recheck=False):
+    """ Return the path of the local copy of the given collection file,
+        fetched on first access. path itself is returned when the cache
+        is disabled or the file can't be copied. The remote file is checked
+        once per session, recheck is True for files updated in place
+        ( e.g. the collection snapshot ).
+    """
+    cache = get_cache()
+    if cache is None:
+        return path
+
+    try:
+        return cache.fetch(path, pin, recheck)
+    except (IOError, OSError, sqlite3.Error) as e:
+        print("Warning: local cache, can't fetch {}: {}".format(path, e))
+        return path
+
+def local_path_expression(path):
+    """ Return the Houdini python parm expression resolving the local copy
+        of the given collection file when evaluated. The collection path
+        is what gets saved in the hip file, the scene still loads on
+        machines without local cache ( or without Gaia ).
+    """
+    return ("path = {0!r}\n"
+            "try:\n"
+            "    from GaiaCollectionPy.core import localCache\n"
+            "    return localCache.local_path(path)\n"
+            "except Exception:\n"
+            "    return path").format(path)
+
+def unpin(path):
+    """ Release a pin taken by local_path( path, pin=True ).
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.unpin(path)
+
+class LocalCache(object):
+    """ Read-through cache of collection files ( geometry, snapshot ) on a
+        local disk. A copy is valid while the size and mtime of the remote
+        file don't change, blob store files are also checked against the
+        hash in their name when copied.
+        When the cache grows over max_bytes the least recently used copies
+        are removed, except the pinned ones ( used by the opened scatters ).
+        Pins are counted, a file stays pinned until every pin is released.
+        Pins and hit / miss counters only last for the session.
+        A remote file is checked once per session, later hits are served
+        from memory: access times are only written to the manifest when
+        copies are evicted and when the session ends.
+    """
+    def __init__(self, cache_root, max_bytes):
+
+        self.cache_root = cache_root
+        self.max_bytes = max_bytes
+        self.db_path = cache_root + os.sep + CACHE_DB
+
+        self.hits = 0
+        self.misses = 0
+        # path: number of pins
+        self.pinned = {}
+
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+        # path: entry, of the files already checked during the session
+        self._checked = {}
+        # paths whose access time isn't written to the manifest yet
+        self._dirty = set()
+
+        if not os.path.isdir(cache_root):
+            os.makedirs(cache_root)
+
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries(
+                path TEXT PRIMARY KEY,
+                local TEXT NOT NULL,
+                size INTEGER,
+                mtime REAL,
+                sha1 TEXT,
+                atime REAL);
+            CREATE INDEX IF NOT EXISTS entries_atime ON entries(atime);""")
+        conn.commit()
+
+        # path: [ local, size, mtime, sha1, atime ]
+        self._entries = {}
+        self.nbytes = 0
+        for path, local, size, mtime, sha1, atime in conn.execute(
+                "SELECT path, local, size, mtime, sha1, atime FROM entries"):
+            self._entries[path] = [local, size, mtime, sha1, atime]
+            self.nbytes += size
+
+        atexit.register(self.flush)
+
+    def _connect(self):
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            # only a cache, no need to wait for the disk
+            conn.execute("PRAGMA synchronous = OFF")
+            self._local.conn = conn
+
+        return conn
+
+    def _local_file(self, key, path):
+
+        h = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.sep.join((self.cache_root, h[:2], h + '_' + os.path.basename(path)))
+
+    def _copy(self, path, local):
+        """ Copy path to local, return the sha1 of the copied data.
+        """
+        folder = os.path.dirname(local)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        h = hashlib.sha1()
+        tmp = "{0}.{1}.tmp".format(local, threading.current_thread().ident)
+        with open(path, "rb") as src:
+            with open(tmp, "wb") as dst:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    dst.write(chunk)
+
+        sha1 = h.hexdigest()
+        m = _BLOB_NAME_RE.match(os.path.basename(path))
+        if m and m.group(1) != sha1:
+            os.remove(tmp)
+            raise IOError("corrupted copy, hash mismatch")
+
+        if os.path.exists(local):
+            os.remove(local)
+        os.rename(tmp, local)
+        return sha1
+
+    def fetch(self, path, pin=False, recheck=False):
+        """ Return the local copy of the given file, copied first if missing
+            or outdated. Raise IOError / OSError if the file can't be read.
+        """
+        key = os.path.normpath(path)
+        now = time.time()
+
+        with self._lock:
+            if pin:
+                self.pinned[key] = self.pinned.get(key, 0) + 1
+
+            entry = None if recheck else self._checked.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[4] = now
+                self._dirty.add(key)
+                return entry[0]
+
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == stat.st_size and entry[2] == stat.st_mtime \
+               and os.path.exists(entry[0]):
+                self.hits += 1
+                entry[4] = now
+                self._dirty.add(key)
+                self._checked[key] = entry
+                return entry[0]
+
+            self.misses += 1
+
+        local = self._local_file(key, path)
+        sha1 = self._copy(path, local)
+
+        with self._lock:
+            old = self._entries.get(key)
+            if old:
+                self.nbytes -= old[1]
+            entry = [local, stat.st_size, stat.st_mtime, sha1, now]
+            self._entries[key] = entry
+            self._checked[key] = entry
+            self._dirty.discard(key)
+            self.nbytes += stat.st_size
+
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO entries VALUES(?,?,?,?,?,?)",
+                             (key, local, stat.st_size, stat.st_mtime, sha1, now))
+            self._evict(keep=key)
+
+        return local
+
+    def flush(self):
+        """ Write the access times updated in memory to the manifest.
+        """
+        with self._lock:
+            rows = [(self._entries[k][4], k) for k in self._dirty \
+                    if k in self._entries]
+            self._dirty = set()
+            if not rows:
+                return
+
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("UPDATE entries SET atime=? WHERE path=?", rows)
+            except sqlite3.Error as e:
+                print("Warning: local cache, can't write access times: {}".format(e))
+
+    def verify(self, path):
+        """ Check the local copy of the given file against the hash computed
+            when it was copied, an invalid copy is removed. Return True if
+            the copy is valid.
+        """
+        key = os.path.normpath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return False
+
+        h = hashlib.sha1()
+        try:
+            with open(entry[0], "rb") as f:
+                while True:
+                    chunk = f.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+        except (IOError, OSError):
+            pass
+
+        if h.hexdigest() == entry[3]:
+            return True
+
+        with self._lock:
+            self._remove(key)
+        return False
+
+    def pin(self, path):
+
+        key = os.path.normpath(path)
+        with self._lock:
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin(self, path):
+
+        key = os.path.normpath(path)
+        with self._lock:
+            n = self.pinned.pop(key, 0) - 1
+            if n > 0:
+                self.pinned[key] = n
+            self._evict()
+
+    def _remove(self, key):
+
+        self._checked.pop(key, None)
+        self._dirty.discard(key)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.nbytes -= entry[1]
+        try:
+            os.remove(entry[0])
+        except OSError:
+            pass
+
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM entries WHERE path=?", (key,))
+
+    def _evict(self, keep=None):
+        """ Remove the least recently used copies until the cache fits
+            in max_bytes, pinned ones and keep are kept.
+        """
+        if self.nbytes <= self.max_bytes:
+            return
+
+        self.flush()
+        candidates = sorted((e[4], k) for k, e in self._entries.items() \
+                            if k not in self.pinned and k != keep)
+        for _, key in candidates:
+            if self.nbytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def set_max_bytes(self, max_bytes):
+
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """ Remove every local copy, pinned ones included.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": float(self.hits) / total if total else 0.0,
+                    "items": len(self._entries), "bytes": self.nbytes,
+                    "max_bytes": self.max_bytes, "pinned": len(self.pinned)}
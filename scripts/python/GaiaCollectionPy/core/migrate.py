@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import base64
+
+from . import indexIO
+from . import thumbnailPack
+
+def migrate_thumbnails(collection_root):
+    """ Move the base64 thumbnails inlined in the sidecars of the given
+        collection to the collection thumbnail pack, sidecars keep only
+        a reference to the pack. Return the number of migrated assets.
+    """
+    pack = thumbnailPack.get_pack(collection_root)
+    index = indexIO.get_index(collection_root)
+    migrated = 0
+
+    for category in indexIO.iter_categories(collection_root):
+
+        folder = indexIO.category_folder(collection_root, category)
+        n = 0
+        for f in os.listdir(folder):
+            if not f.endswith(".json"):
+                continue
+
+            sidecar = folder + os.sep + f
+            try:
+                with open(sidecar) as m:
+                    metadata = json.load(m)
+            except (IOError, ValueError):
+                print("Warning: invalid metadata file: " + sidecar)
+                continue
+
+            pixdata = metadata.pop("thumbnail", None)
+            if not pixdata or "uid" not in metadata:
+                continue
+
+            pack.write(metadata["uid"], base64.b64decode(pixdata))
+            metadata["thumbnail_ref"] = thumbnailPack.PACK_REF
+
+            # write a temp file first, a failure must not corrupt the sidecar
+            tmp = sidecar + ".tmp"
+            with open(tmp, 'w') as m:
+                json.dump(metadata, m, indent=4)
+            os.remove(sidecar)
+            os.rename(tmp, sidecar)
+            n += 1
+
+        if n and index.is_indexed(category):
+            index.refresh(category)
+
+        migrated += n
+
+    return migrated
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m GaiaCollectionPy.core.migrate <collection_root>")
+        sys.exit(1)
+
+    n = migrate_thumbnails(sys.argv[1])
+    print("{} asset(s) migrated".format(n))
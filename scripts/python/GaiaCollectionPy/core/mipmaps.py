@@ -0,0 +1,83 @@
+import sys
+
+from PySide2 import QtCore
+from PySide2 import QtGui
+
+from . import indexIO
+from . import thumbnailPack
+
+# thumbnail heights used by the UI: collection grid, scatter instances list,
+# the captured 150px thumbnail is kept as is for tooltips
+GRID_LEVEL = 85
+INSTANCE_LEVEL = 90
+LEVELS = (GRID_LEVEL, INSTANCE_LEVEL)
+
+JPG_QUALITY = 90
+
+def make_levels(data, levels=LEVELS):
+    """ Return a { level: jpg data } dict of the given jpg data scaled
+        to every level height. Thread safe, no QPixmap involved.
+    """
+    image = QtGui.QImage()
+    if not data or not image.loadFromData(data):
+        return {}
+
+    result = {}
+    for level in levels:
+        scaled = image.scaledToHeight(level, QtCore.Qt.SmoothTransformation)
+
+        buf = QtCore.QBuffer()
+        buf.open(QtCore.QIODevice.WriteOnly)
+        scaled.save(buf, "JPG", JPG_QUALITY)
+        result[level] = bytes(buf.data())
+        buf.close()
+
+    return result
+
+def write_levels(collection_root, uid, data, levels=LEVELS):
+    """ Store the pre-scaled levels of the given thumbnail in the level
+        packs of the collection.
+    """
+    for level, level_data in make_levels(data, levels).items():
+        thumbnailPack.get_pack(collection_root, level).write(uid, level_data)
+
+def missing_levels(collection_root, uid, levels=LEVELS):
+
+    return [l for l in levels if uid not in thumbnailPack.get_pack(collection_root, l)]
+
+def backfill(collection_root, levels=LEVELS):
+    """ Create the missing pre-scaled levels of every asset of the collection,
+        the whole collection is indexed first. Return the number of updated
+        assets.
+    """
+    index = indexIO.get_index(collection_root)
+    index.index_all()
+
+    n = 0
+    for category in indexIO.iter_categories(collection_root):
+        for metadata in index.get_items(category):
+
+            missing = missing_levels(collection_root, metadata["uid"], levels)
+            if not missing:
+                continue
+
+            data = indexIO.get_thumbnail(collection_root, metadata)
+            if not data:
+                continue
+
+            write_levels(collection_root, metadata["uid"], data, missing)
+            n += 1
+
+    return n
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m GaiaCollectionPy.core.mipmaps <collection_root>")
+        sys.exit(1)
+
+    # jpg image plugins need an application instance
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+
+    n = backfill(sys.argv[1])
+    print("{} asset(s) updated".format(n))
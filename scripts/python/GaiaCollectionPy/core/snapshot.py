@@ -0,0 +1,287 @@
+import os
+import time
+import mmap
+import json
+import struct
+import binascii
+import threading
+
+SNAPSHOT_FILE = "collection.gaiacr"
+
+MAGIC = b"GCR1"
+VERSION = 1
+
+# magic, version, index mtime, index size, number of categories, assets and
+# thumbnail packs, offsets of the categories, assets, uid order, packs,
+# spans and strings sections
+HEADER = struct.Struct("<4sIdQIII6Q")
+# name offset, name length, first asset row, assets count, indexed,
+# geometry files size
+CATEGORY_ENTRY = struct.Struct("<QIIIIQ")
+# uid ( binary sha1 ), category row, npoints, nprims, geometry file size
+# ( -1 when missing ), metadata json offset and length
+ASSET_ENTRY = struct.Struct("<20sIqqqQI")
+# thumbnail pack level ( 0 for the base pack ), size of its offset table
+PACK_ENTRY = struct.Struct("<IQ")
+# offset and length of an asset thumbnail in a pack, 0 length if missing
+SPAN_ENTRY = struct.Struct("<QI")
+ROW = struct.Struct("<I")
+
+# the snapshot can't be replaced on Windows while an other session opens it
+REPLACE_RETRIES = 20
+REPLACE_DELAY = 0.05
+
+def _int(value):
+
+    return -1 if value is None else int(value)
+
+def _replace(src, dst):
+    """ Rename src to dst, replacing dst atomically.
+    """
+    if os.name != "nt":
+        os.rename(src, dst)
+        return
+
+    import ctypes
+    MOVEFILE_REPLACE_EXISTING = 0x1
+    for _ in range(REPLACE_RETRIES):
+        if ctypes.windll.kernel32.MoveFileExW(src, dst, MOVEFILE_REPLACE_EXISTING):
+            return
+        time.sleep(REPLACE_DELAY)
+
+    raise OSError("Can't replace snapshot file: " + dst)
+
+def write(path, index_stat, categories, assets, packs):
+    """ Write the snapshot file atomically, raise IOError / OSError if it
+        can't be written ( the index is read from sqlite meanwhile ).
+        index_stat is the os.stat() of the index the snapshot is made of.
+        categories is a { category: indexed } dict, assets a list of
+        ( uid, category, npoints, nprims, file_size, metadata json ) sorted
+        by category and packs a list of ( level, table size, { uid:
+        ( offset, length ) } ) of the thumbnail packs.
+    """
+    names = sorted(set(categories) | set(a[1] for a in assets))
+    category_rows = dict((c, i) for i, c in enumerate(names))
+
+    strings = []
+    strings_size = [0]
+    def add_string(text):
+        data = text.encode("utf-8")
+        offset = strings_size[0]
+        strings.append(data)
+        strings_size[0] += len(data)
+        return offset, len(data)
+
+    # assets count and geometry size per category
+    first = {}
+    count = dict.fromkeys(names, 0)
+    nbytes = dict.fromkeys(names, 0)
+    asset_entries = []
+    for row, (uid, category, npoints, nprims, file_size, metadata) in enumerate(assets):
+        first.setdefault(category, row)
+        count[category] += 1
+        nbytes[category] += file_size or 0
+
+        offset, length = add_string(metadata)
+        asset_entries.append(ASSET_ENTRY.pack(binascii.unhexlify(uid),
+                                              category_rows[category],
+                                              _int(npoints), _int(nprims),
+                                              _int(file_size), offset, length))
+
+    category_entries = []
+    for category in names:
+        offset, length = add_string(category)
+        category_entries.append(CATEGORY_ENTRY.pack(
+            offset, length, first.get(category, 0), count[category],
+            1 if categories.get(category, count[category] > 0) else 0,
+            nbytes[category]))
+
+    uid_order = sorted(range(len(assets)),
+                       key=lambda row: binascii.unhexlify(assets[row][0]))
+
+    pack_entries = []
+    span_entries = []
+    for level, table_size, offsets in packs:
+        pack_entries.append(PACK_ENTRY.pack(level or 0, table_size))
+        for asset in assets:
+            span_entries.append(SPAN_ENTRY.pack(*offsets.get(asset[0], (0, 0))))
+
+    sections = [b''.join(category_entries), b''.join(asset_entries),
+                b''.join(ROW.pack(row) for row in uid_order),
+                b''.join(pack_entries), b''.join(span_entries)]
+    positions = []
+    pos = HEADER.size
+    for section in sections:
+        positions.append(pos)
+        pos += len(section)
+    positions.append(pos)
+
+    header = HEADER.pack(MAGIC, VERSION, index_stat.st_mtime, index_stat.st_size,
+                         len(names), len(assets), len(packs), *positions)
+
+    # written to a temp file first, then renamed over the previous snapshot:
+    # readers never see a partial or missing snapshot. Every session and
+    # thread writes its own temp file.
+    tmp = "{0}.{1}.{2}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for section in sections:
+                f.write(section)
+            for data in strings:
+                f.write(data)
+
+        _replace(tmp, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def open_snapshot(path):
+    """ Return the Snapshot of the given file, None if missing or invalid.
+    """
+    try:
+        return Snapshot(path)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+class Snapshot(object):
+    """ Read only, memory mapped view of a collection snapshot file
+        ( collection.gaiacr ): category tree with assets counts and sizes,
+        per asset metadata columns and thumbnail pack offsets, written by
+        the collection index after every update. Only the categories table
+        is read when opened, assets are read on demand from the mapping.
+    """
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError("Invalid snapshot file: " + path)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self._map, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self._map.close()
+            raise ValueError("Invalid snapshot file: " + path)
+
+        (_, _, self.index_mtime, self.index_size, self.ncategories, self.nassets,
+         self.npacks, self._categories_pos, self._assets_pos, self._uids_pos,
+         self._packs_pos, self._spans_pos, self._strings_pos) = header
+
+        # category: ( first asset row, assets count, indexed, geometry size )
+        self.categories = {}
+        self._category_names = []
+        for i in range(self.ncategories):
+            offset, length, first, count, indexed, nbytes = CATEGORY_ENTRY.unpack_from(
+                self._map, self._categories_pos + i * CATEGORY_ENTRY.size)
+            name = self._string(offset, length)
+            self.categories[name] = (first, count, bool(indexed), nbytes)
+            self._category_names.append(name)
+
+        # level: ( pack row, offset table size )
+        self.packs = {}
+        for i in range(self.npacks):
+            level, table_size = PACK_ENTRY.unpack_from(
+                self._map, self._packs_pos + i * PACK_ENTRY.size)
+            self.packs[level or None] = (i, table_size)
+
+    def _string(self, offset, length):
+
+        pos = self._strings_pos + offset
+        return self._map[pos:pos + length].decode("utf-8")
+
+    def _asset(self, row):
+
+        return ASSET_ENTRY.unpack_from(self._map, self._assets_pos + row * ASSET_ENTRY.size)
+
+    def _metadata(self, row):
+
+        entry = self._asset(row)
+        return json.loads(self._string(entry[5], entry[6]))
+
+    def matches(self, index_path):
+        """ Return True if the snapshot is up to date with the given
+            index file.
+        """
+        try:
+            stat = os.stat(index_path)
+        except OSError:
+            return False
+
+        return stat.st_mtime == self.index_mtime and stat.st_size == self.index_size
+
+    def list_categories(self):
+
+        return list(self._category_names)
+
+    def is_indexed(self, category):
+
+        entry = self.categories.get(category)
+        return entry is not None and entry[2]
+
+    def category_stats(self):
+        """ Return { category: ( assets count, geometry files size ) } of
+            the indexed categories.
+        """
+        return dict((c, (e[1], e[3])) for c, e in self.categories.items() if e[2])
+
+    def get_items(self, category):
+        """ Return the metadata of the given category assets, sorted
+            by name.
+        """
+        entry = self.categories.get(category)
+        if entry is None:
+            return []
+
+        first, count = entry[0], entry[1]
+        return [self._metadata(row) for row in range(first, first + count)]
+
+    def _find(self, uid):
+        """ Return the asset row of the given uid, None if not found,
+            binary search of the uid ordered rows.
+        """
+        try:
+            key = binascii.unhexlify(uid)
+        except (TypeError, ValueError, binascii.Error):
+            return None
+
+        lo, hi = 0, self.nassets
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = ROW.unpack_from(self._map, self._uids_pos + mid * ROW.size)[0]
+            mid_key = self._asset(row)[0]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return row
+
+        return None
+
+    def get_item(self, uid):
+
+        row = self._find(uid)
+        if row is None:
+            return None
+        return self._metadata(row)
+
+    def thumbnail_span(self, uid, level=None):
+        """ Return ( offset, length ) of the given asset thumbnail in the
+            given level pack, as of the snapshot, None if not found.
+        """
+        pack = self.packs.get(level)
+        row = self._find(uid) if pack is not None else None
+        if row is None:
+            return None
+
+        pos = self._spans_pos + (pack[0] * self.nassets + row) * SPAN_ENTRY.size
+        offset, length = SPAN_ENTRY.unpack_from(self._map, pos)
+        return (offset, length) if length else None
+
+    def close(self):
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
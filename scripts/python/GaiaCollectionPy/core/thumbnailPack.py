@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import mmap
+import struct
+import binascii
+import threading
+
+PACK_FILE = "thumbnails.gtp"
+TABLE_FILE = "thumbnails.gti"
+PACK_REF = "%ROOT%/" + PACK_FILE
+
+# pre-scaled thumbnails are stored in one pack per level ( height in px ),
+# e.g. thumbnails_85.gtp, the base pack keeps the captured thumbnails
+LEVEL_FILE = "thumbnails_{0}{1}"
+_LEVEL_TABLE_RE = re.compile(r"^thumbnails_(\d+)\.gti$")
+
+# appends are serialised between sessions by an exclusive lock file next
+# to the pack, a lock older than LOCK_STALE seconds is left by a crashed
+# session and is broken
+LOCK_SUFFIX = ".lock"
+LOCK_TIMEOUT = 30.0
+LOCK_STALE = 60.0
+
+TABLE_MAGIC = b"GTI1"
+# uid ( binary sha1 ), offset in pack, length of jpg data
+TABLE_ENTRY = struct.Struct("<20sQI")
+
+try:
+    _PACKS
+except NameError:
+    _PACKS = {}
+
+def get_pack(collection_root, level=None):
+    """ Return the ThumbnailPack of the given collection root, shared
+        for the whole session. level is the height of a pre-scaled
+        thumbnails pack, None for the base pack.
+    """
+    key = (os.path.normpath(collection_root), level)
+    pack = _PACKS.get(key)
+    if pack is None:
+        pack = ThumbnailPack(collection_root, level)
+        _PACKS[key] = pack
+
+    return pack
+
+def list_levels(collection_root):
+    """ Return the sorted levels of the pre-scaled packs found in the
+        given collection.
+    """
+    levels = []
+    if os.path.isdir(collection_root):
+        for f in os.listdir(collection_root):
+            m = _LEVEL_TABLE_RE.match(f)
+            if m:
+                levels.append(int(m.group(1)))
+
+    return sorted(levels)
+
+class PackLock(object):
+    """ Cross-process lock of a pack: the lock file is created with
+        O_EXCL, which is atomic on local and network file systems.
+    """
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+
+        start = time.time()
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return self
+            except OSError:
+                pass
+
+            try:
+                if time.time() - os.path.getmtime(self.path) > LOCK_STALE:
+                    os.remove(self.path)
+                    continue
+            except OSError:
+                # released meanwhile
+                continue
+
+            if time.time() - start > self.timeout:
+                raise IOError("Can't lock thumbnail pack: " + self.path)
+            time.sleep(0.01)
+
+    def __exit__(self, *args):
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class ThumbnailPack(object):
+    """ Binary thumbnails storage of a collection: a single file of raw jpg
+        blobs ( thumbnails.gtp ) and an append-only offset table keyed by
+        asset uid ( thumbnails.gti ). The pack is read through mmap, when
+        a uid is written several times the last entry wins.
+        Packs of pre-scaled levels use the same format.
+    """
+    def __init__(self, collection_root, level=None):
+
+        self.collection_root = collection_root
+        self.level = level
+        if level is None:
+            self.pack_path = collection_root + os.sep + PACK_FILE
+            self.table_path = collection_root + os.sep + TABLE_FILE
+        else:
+            self.pack_path = collection_root + os.sep + LEVEL_FILE.format(level, ".gtp")
+            self.table_path = collection_root + os.sep + LEVEL_FILE.format(level, ".gti")
+
+        self.offsets = {}
+        self._table_pos = len(TABLE_MAGIC)
+        self._map = None
+        self._map_size = 0
+        self._lock = threading.Lock()
+
+        # ( spans, table size ) of the collection snapshot, used instead of
+        # reading the whole offset table as long as the table doesn't change
+        self._snapshot = None
+
+    def _sync_table(self):
+        """ Read entries appended to the offset table since last read,
+            ( by this session or by an other artist ).
+        """
+        if not os.path.exists(self.table_path):
+            return
+
+        size = os.path.getsize(self.table_path)
+        if size <= self._table_pos:
+            return
+
+        with open(self.table_path, "rb") as f:
+            if f.read(len(TABLE_MAGIC)) != TABLE_MAGIC:
+                print("Warning: invalid thumbnail table: " + self.table_path)
+                return
+
+            f.seek(self._table_pos)
+            data = f.read(size - self._table_pos)
+
+        n = len(data) // TABLE_ENTRY.size
+        for i in range(n):
+            uid, offset, length = TABLE_ENTRY.unpack_from(data, i * TABLE_ENTRY.size)
+            self.offsets[binascii.hexlify(uid).decode("ascii")] = (offset, length)
+
+        self._table_pos += n * TABLE_ENTRY.size
+
+    def set_snapshot(self, spans, table_size):
+        """ spans( uid ) returns the ( offset, length ) of the given uid as
+            of a collection snapshot made when the offset table size was
+            table_size, or None. Not locked, spans() can take the index lock.
+        """
+        self._snapshot = (spans, table_size)
+
+    def _snapshot_span(self, uid):
+
+        state = self._snapshot
+        if state is None or self._table_pos > len(TABLE_MAGIC):
+            return None
+
+        try:
+            size = os.path.getsize(self.table_path)
+        except OSError:
+            size = 0
+        if size != state[1]:
+            # written since the snapshot
+            self._snapshot = None
+            return None
+
+        return state[0](uid)
+
+    def table_state(self):
+        """ Return ( { uid: ( offset, length ) }, offset table size ) of
+            the whole table.
+        """
+        with self._lock:
+            self._sync_table()
+            return dict(self.offsets), self._table_pos
+
+    def _remap(self):
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+
+        if not os.path.exists(self.pack_path):
+            return
+
+        size = os.path.getsize(self.pack_path)
+        if size == 0:
+            return
+
+        with open(self.pack_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._map_size = size
+
+    def __contains__(self, uid):
+
+        with self._lock:
+            if uid in self.offsets or self._snapshot_span(uid):
+                return True
+            self._sync_table()
+            return uid in self.offsets
+
+    def read(self, uid):
+        """ Return the raw jpg data of the given uid, None if not found.
+        """
+        with self._lock:
+            entry = self.offsets.get(uid) or self._snapshot_span(uid)
+            if entry is None:
+                self._sync_table()
+                entry = self.offsets.get(uid)
+                if entry is None:
+                    return None
+
+            offset, length = entry
+            if offset + length > self._map_size:
+                self._remap()
+                if offset + length > self._map_size:
+                    return None
+
+            return self._map[offset:offset + length]
+
+    def write(self, uid, data):
+        """ Append the given jpg data to the pack and register it
+            in the offset table. Other sessions can append to the same
+            pack, the pack and the table are locked until both are written
+            so the offset always points at this data.
+        """
+        with self._lock:
+            with PackLock(self.pack_path + LOCK_SUFFIX):
+                with open(self.pack_path, "ab") as f:
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    f.write(data)
+
+                new_table = not os.path.exists(self.table_path)
+                with open(self.table_path, "ab") as f:
+                    if new_table:
+                        f.write(TABLE_MAGIC)
+                    f.write(TABLE_ENTRY.pack(binascii.unhexlify(uid), offset,
+                                             len(data)))
+
+            self._sync_table()
@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import getpass
+import argparse
+import threading
+
+from . import indexIO
+from . import localCache
+
+USAGE_FILE = "usage.gaiadb"
+
+try:
+    _USAGE_INDEXES
+except NameError:
+    _USAGE_INDEXES = {}
+
+def get_usage_index(collection_root):
+    """ Return the UsageIndex of the given collection root, shared per
+        root for the whole session.
+    """
+    key = os.path.normpath(collection_root)
+    index = _USAGE_INDEXES.get(key)
+    if index is None:
+        index = UsageIndex(collection_root)
+        _USAGE_INDEXES[key] = index
+
+    return index
+
+class UsageIndex(object):
+    """ Reverse index of the collection assets used by Gaia scatter layers:
+        one row per ( asset uid, hip file, layer node ). It is kept next to
+        the collection index ( usage.gaiadb ) and updated by the scatter tool
+        whenever instances of a layer change, so where an asset is used can
+        be answered without opening any hip file.
+    """
+    def __init__(self, collection_root):
+
+        self.collection_root = collection_root
+        self.db_path = collection_root + os.sep + USAGE_FILE
+
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS usage(
+                uid TEXT NOT NULL,
+                hip TEXT NOT NULL,
+                node TEXT NOT NULL,
+                scatter TEXT,
+                user TEXT,
+                time REAL,
+                PRIMARY KEY(uid, hip, node));
+            CREATE INDEX IF NOT EXISTS usage_hip ON usage(hip, node);""")
+        conn.commit()
+
+    def _connect(self):
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            self._local.conn = conn
+
+        return conn
+
+    def set_layer(self, hip, node, uids, scatter=None):
+        """ Replace the assets used by the given layer node of the given hip
+            file, an empty uids list forgets the layer.
+        """
+        user = getpass.getuser()
+        now = time.time()
+
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM usage WHERE hip=? AND node=?", (hip, node))
+            conn.executemany("INSERT OR REPLACE INTO usage VALUES(?,?,?,?,?,?)",
+                             [(uid, hip, node, scatter, user, now) \
+                              for uid in set(uids)])
+
+    def forget_hip(self, hip):
+        """ Remove every usage recorded for the given hip file.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM usage WHERE hip=?", (hip,))
+
+    def where_used(self, uid):
+        """ Return the usages of the given asset uid as a list of dict:
+            { "hip", "node", "scatter", "user", "time" }, sorted by hip
+            file and node.
+        """
+        conn = self._connect()
+        rows = conn.execute(("SELECT hip, node, scatter, user, time FROM usage "
+                             "WHERE uid=? ORDER BY hip, node"), (uid,))
+        return [{"hip": r[0], "node": r[1], "scatter": r[2], "user": r[3],
+                 "time": r[4]} for r in rows]
+
+    def usage_counts(self, uids=None):
+        """ Return { uid: number of hip files using it } of the given uids,
+            or of every used asset if uids is None. Unused uids are 0.
+        """
+        conn = self._connect()
+        counts = dict.fromkeys(uids or [], 0)
+        for uid, n in conn.execute(("SELECT uid, COUNT(DISTINCT hip) FROM usage "
+                                    "GROUP BY uid")):
+            if uids is None or uid in counts:
+                counts[uid] = n
+
+        return counts
+
+    def is_used(self, uid):
+        """ Return True if any scatter layer uses the given asset, to check
+            before deleting it.
+        """
+        conn = self._connect()
+        return conn.execute("SELECT 1 FROM usage WHERE uid=? LIMIT 1",
+                            (uid,)).fetchone() is not None
+
+    def hip_assets(self, hip):
+        """ Return the sorted uids of the assets used by the given hip file,
+            e.g. to prefetch only what a scene needs.
+        """
+        conn = self._connect()
+        return [r[0] for r in conn.execute(
+            "SELECT DISTINCT uid FROM usage WHERE hip=? ORDER BY uid", (hip,))]
+
+    def hip_files(self):
+
+        conn = self._connect()
+        return [r[0] for r in conn.execute(
+            "SELECT DISTINCT hip FROM usage ORDER BY hip")]
+
+def prefetch_hip(collection_root, hip):
+    """ Copy the geometry of the assets of the given collection used by the
+        given hip file to the local cache. Return the number of files
+        available locally.
+    """
+    if localCache.get_cache() is None:
+        return 0
+
+    index = indexIO.get_index(collection_root)
+    n = 0
+    for uid in get_usage_index(collection_root).hip_assets(hip):
+
+        metadata = index.get_item(uid)
+        if metadata is None:
+            continue
+
+        path = indexIO.geometry_path(collection_root, metadata)
+        if os.path.exists(path) and localCache.local_path(path) != path:
+            n += 1
+
+    return n
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python -m GaiaCollectionPy.core.usageIndex",
+                                     description="Assets usage of Gaia scatters")
+    parser.add_argument("collection_root")
+    parser.add_argument("--uid", help="list the hip files using this asset")
+    parser.add_argument("--hip", help="list the assets used by this hip file")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="copy the assets of --hip to the local cache")
+    args = parser.parse_args()
+
+    usage_index = get_usage_index(args.collection_root)
+    if args.uid:
+        for usage in usage_index.where_used(args.uid):
+            print("{hip}  {node}  ( {user} )".format(**usage))
+    elif args.hip and args.prefetch:
+        n = prefetch_hip(args.collection_root, args.hip)
+        print("{} asset(s) available locally".format(n))
+    elif args.hip:
+        for uid in usage_index.hip_assets(args.hip):
+            print(uid)
+    else:
+        for hip in usage_index.hip_files():
+            print(hip)
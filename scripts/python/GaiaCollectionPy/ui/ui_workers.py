@@ -1,50 +1,555 @@
 import os
 import json
 import time
+from PySide2 import QtGui
 from PySide2 import QtCore
 
-class GetCollectionItems(QtCore.QObject):
+from ..core import indexIO
+reload(indexIO)
+from ..core import duplicates
+reload(duplicates)
+
+# items are sent to the grid by batches of BATCH_SIZE items, or
+# every BATCH_INTERVAL seconds, whichever comes first
+BATCH_SIZE = 64
+BATCH_INTERVAL = 0.016
+
+# term prefixes length kept by the grid filter index
+FILTER_PREFIX_LEN = 3
 
+class GetCollectionItems(QtCore.QObject):
+    """ Fetch the items of a category ( or of a search ) from the collection
+        index, changed sidecars are parsed by a pool of max_workers threads.
+        Items are sent by batches through add_entries, then the in-memory
+        search index of the displayed items through filter_index, end_process
+        sends the parsing stats:
+        { "files", "bytes", "elapsed", "files_per_sec", "mb_per_sec" }
+        categories_changed is emitted when a refresh found category folders
+        added or removed.
+    """
     init_run = QtCore.Signal(str)
+    init_search = QtCore.Signal(str)
+    init_refresh = QtCore.Signal(str)
 
     start_process = QtCore.Signal(int)
-    add_entry = QtCore.Signal(dict)
-    end_process = QtCore.Signal()
+    add_entries = QtCore.Signal(list)
+    filter_index = QtCore.Signal(object)
+    end_process = QtCore.Signal(dict)
     cancel_process = QtCore.Signal()
+    categories_changed = QtCore.Signal()
 
-    def __init__(self):
+    def __init__(self, collection_root, max_workers=indexIO.DEFAULT_WORKERS):
         super(GetCollectionItems, self).__init__()
         
         self.cancel = False
+        self.collection_root = collection_root
+        self.max_workers = max_workers
+        self.stats = {}
         self.init_run.connect(self.run)
+        self.init_search.connect(self.search)
+        self.init_refresh.connect(self.refresh)
 
     @QtCore.Slot()
-    def run(self, collection_folder):
+    def run(self, category):
 
-        if not collection_folder or not os.path.exists(collection_folder):
+        if not category:
+            return
+        self.cancel = False
+
+        # sidecars are only stat'ed, the ones changed since they were
+        # indexed ( by any session, or while none was running ) are parsed
+        index = indexIO.get_index(self.collection_root)
+        self.set_stats(index.rescan(category, self.max_workers)["stats"])
+        items = index.get_items(category)
+        self.emit_items(items)
+
+    @QtCore.Slot()
+    def refresh(self, category):
+        """ Re-parse every sidecar of the given category and walk the
+            category folders again, then send the category items.
+        """
+        if not category:
             return
         self.cancel = False
 
-        files = [f for f in os.listdir(collection_folder) if f.endswith(".json")]
+        start = time.time()
+        index = indexIO.get_index(self.collection_root)
+        n = index.refresh(category, self.max_workers)
+        if index.list_categories() != index.list_categories(rescan=True):
+            self.categories_changed.emit()
+
+        self.set_stats({"files": n, "bytes": 0,
+                        "elapsed": time.time() - start})
+        self.emit_items(index.get_items(category))
+
+    @QtCore.Slot()
+    def search(self, query):
+        """ Search the whole collection, categories never browsed
+            are indexed first, only the index is queried afterwards.
+        """
+        if not query:
+            return
+        self.cancel = False
+
+        start = time.time()
+        index = indexIO.get_index(self.collection_root)
+        index.index_all(self.max_workers)
+        self.set_stats({"files": 0, "bytes": 0, "elapsed": time.time() - start})
+        try:
+            items = index.search(query)
+        except ValueError as e:
+            print("Warning: " + str(e))
+            items = []
+
+        self.emit_items(items)
+
+    def set_stats(self, stats):
+
+        stats = dict(stats)
+        elapsed = max(stats["elapsed"], 1e-6)
+        stats["files_per_sec"] = stats["files"] / elapsed
+        stats["mb_per_sec"] = stats["bytes"] / elapsed / (1024.0 * 1024.0)
+        self.stats = stats
+
+    def emit_items(self, items):
+
         if self.cancel:
             self.cancel_process.emit()
             return
 
-        if files:
-            self.start_process.emit(len(files))
+        if items:
+            self.start_process.emit(len(items))
 
-        for f in files:
+        batch = []
+        last_emit = time.time()
+        for metadata in items:
             
             if self.cancel:
                 self.cancel_process.emit()
                 return
 
-            with open(collection_folder + os.sep + f) as m:
-                metadata = json.load(m)
+            batch.append(metadata)
+            if len(batch) >= BATCH_SIZE or \
+               time.time() - last_emit >= BATCH_INTERVAL:
+                self.add_entries.emit(batch)
+                batch = []
+                last_emit = time.time()
+
+        if batch:
+            self.add_entries.emit(batch)
+
+        self.filter_index.emit(self.build_filter_index(items))
+        self.end_process.emit(self.stats)
+
+    def build_filter_index(self, items):
+        """ Return the SearchIndex of the given items, built in the worker
+            thread as tokenizing is the costly part.
+        """
+        search_index = indexIO.SearchIndex(prefix_len=FILTER_PREFIX_LEN)
+        search_index.load_items(items)
+        return search_index
+
+
+def decode_thumbnail(collection_root, metadata, size):
+    """ Return the thumbnail of the given asset decoded and scaled to
+        a QImage, can be called from any thread. The QImage is null
+        if the asset has no thumbnail.
+    """
+    image = QtGui.QImage()
+    try:
+        data = indexIO.get_thumbnail(collection_root, metadata, size)
+    except (IOError, OSError):
+        data = None
+
+    # pre-scaled levels are used as is
+    if data and image.loadFromData(data) and image.height() != size:
+        image = image.scaledToHeight(size, QtCore.Qt.SmoothTransformation)
+
+    return image
+
+class DecodeThumbnail(QtCore.QRunnable):
+    """ Read, decode and scale a single thumbnail to a QImage, run by the
+        ThumbnailLoader thread pool.
+    """
+    def __init__(self, loader, metadata, size):
+        super(DecodeThumbnail, self).__init__()
+
+        self.loader = loader
+        self.metadata = metadata
+        self.size = size
+
+    def run(self):
+
+        image = decode_thumbnail(self.loader.collection_root, self.metadata,
+                                 self.size)
+        self.loader.thumbnail_ready.emit(self.metadata["uid"], self.size, image)
+
+class ThumbnailLoader(QtCore.QObject):
+    """ Decode and scale thumbnails to QImage in a pool of worker threads,
+        thumbnail_ready is received in the UI thread where only the
+        QImage to QPixmap conversion is left to do.
+    """
+    thumbnail_ready = QtCore.Signal(str, int, QtGui.QImage)
+
+    def __init__(self, collection_root, max_workers=4, parent=None):
+        super(ThumbnailLoader, self).__init__(parent=parent)
+
+        self.collection_root = collection_root
+        self.pending = set()
+
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.thumbnail_ready.connect(self.finished)
+
+    def is_pending(self, uid, size):
+
+        return (uid, size) in self.pending
+
+    def request(self, metadata, size):
+
+        key = (metadata["uid"], size)
+        if key in self.pending:
+            return
+
+        self.pending.add(key)
+        self.pool.start(DecodeThumbnail(self, metadata, size))
+
+    def cancel(self):
+        """ Drop the queued requests, the running ones still finish.
+        """
+        self.pool.clear()
+        self.pending.clear()
+
+    @QtCore.Slot(str, int, QtGui.QImage)
+    def finished(self, uid, size, image):
+
+        self.pending.discard((uid, size))
+
+class FindDuplicates(QtCore.QRunnable):
+    """ Index the whole collection, hash the thumbnails not hashed yet and
+        group the duplicated assets, run by the DuplicatesFinder pool.
+    """
+    def __init__(self, finder, request_id):
+        super(FindDuplicates, self).__init__()
+
+        self.finder = finder
+        self.request_id = request_id
+
+    def run(self):
+
+        index = indexIO.get_index(self.finder.collection_root)
+        index.index_all()
+
+        groups = []
+        for uids in duplicates.duplicate_groups(self.finder.collection_root):
+            items = [m for m in map(index.get_item, uids) if m]
+            if len(items) > 1:
+                groups.append(items)
+
+        search_index = indexIO.SearchIndex(prefix_len=FILTER_PREFIX_LEN)
+        search_index.load_items([m for items in groups for m in items])
+        self.finder.finished.emit(self.request_id, groups, search_index)
+
+class DuplicatesFinder(QtCore.QObject):
+    """ Find the duplicated assets of the collection in a worker thread,
+        groups_ready sends the groups ( lists of metadata, largest first )
+        with the search index of their items. Only the result of the last
+        request is sent.
+    """
+    finished = QtCore.Signal(int, list, object)
+    groups_ready = QtCore.Signal(list, object)
+
+    def __init__(self, collection_root, parent=None):
+        super(DuplicatesFinder, self).__init__(parent=parent)
+
+        self.collection_root = collection_root
+        self.request_id = 0
+
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.finished.connect(self.request_finished)
+
+    def request(self):
+
+        self.request_id += 1
+        self.pool.start(FindDuplicates(self, self.request_id))
+
+    def cancel(self):
+        """ The running search still finishes, its result is dropped.
+        """
+        self.request_id += 1
+
+    @QtCore.Slot(int, list, object)
+    def request_finished(self, request_id, groups, search_index):
+
+        if request_id == self.request_id:
+            self.groups_ready.emit(groups, search_index)
+
+class CategoryPrefetcher(QtCore.QObject):
+    """ Low priority warm up of the sibling and child categories of the
+        displayed one: thumbnails of the already indexed ones are decoded,
+        then sent through thumbnail_ready to be cached by the UI thread.
+        Categories never indexed are skipped, parsing them can't yield to
+        a foreground load.
+        Prefetch stops when max_bytes of thumbnails are decoded, and as soon
+        as cancel is set by a foreground load. cached is the set of ( uid,
+        size ) already in the thumbnail cache, taken by the UI thread.
+    """
+    init_prefetch = QtCore.Signal(str, int, object)
+    thumbnail_ready = QtCore.Signal(str, int, QtGui.QImage)
+
+    def __init__(self, collection_root, size):
+        super(CategoryPrefetcher, self).__init__()
+
+        self.cancel = False
+        self.collection_root = collection_root
+        self.size = size
+        self.init_prefetch.connect(self.run)
+
+    def neighbours(self, category):
+        """ Return the sibling categories then the child categories
+            of the given one, as listed by the index.
+        """
+        categories = indexIO.get_index(self.collection_root).list_categories()
+        def sub_categories(parent):
+            return [c for c in categories if c.rsplit('/', 1)[0] == parent]
+
+        parent = category.rsplit('/', 1)[0]
+        siblings = [c for c in sub_categories(parent) if c != category]
+        return siblings + sub_categories(category)
+
+    @QtCore.Slot()
+    def run(self, category, max_bytes, cached):
+
+        if not category:
+            return
+        self.cancel = False
+
+        index = indexIO.get_index(self.collection_root)
+        nbytes = 0
+        for neighbour in self.neighbours(category):
+
             if self.cancel:
-                self.cancel_process.emit()
                 return
 
-            self.add_entry.emit(metadata)
+            if not index.is_indexed(neighbour):
+                continue
+
+            for metadata in index.get_items(neighbour):
+
+                if self.cancel:
+                    return
+
+                if (metadata["uid"], self.size) in cached:
+                    continue
+
+                image = decode_thumbnail(self.collection_root, metadata,
+                                         self.size)
+                nbytes += image.byteCount()
+                if nbytes > max_bytes:
+                    return
+
+                self.thumbnail_ready.emit(metadata["uid"], self.size, image)
+
+class RescanCategories(QtCore.QObject):
+    """ Incremental rescan of the categories changed on disk, run in the
+        collection watcher thread. The category folders are walked again
+        only when folders were added or removed.
+    """
+    init_rescan = QtCore.Signal(list, bool)
+
+    items_changed = QtCore.Signal(str, dict)
+    categories_changed = QtCore.Signal(list)
+
+    def __init__(self, collection_root):
+        super(RescanCategories, self).__init__()
+
+        self.collection_root = collection_root
+        self.init_rescan.connect(self.run)
+
+    @QtCore.Slot()
+    def run(self, categories, folders_changed):
+
+        index = indexIO.get_index(self.collection_root)
+        if folders_changed:
+            known = index.list_categories()
+            current = index.list_categories(rescan=True)
+            if current != known:
+                self.categories_changed.emit(current)
+
+        for category in categories:
+
+            if not index.is_indexed(category):
+                continue
+
+            delta = index.rescan(category)
+            if delta["added"] or delta["modified"] or delta["removed"]:
+                self.items_changed.emit(category, delta)
+
+class CollectionWatcher(QtCore.QObject):
+    """ Watch the collection folders and push only the delta of the changed
+        categories ( see CollectionIndex.rescan ) through items_changed.
+        Events are debounced: a bulk copy of many files produces a single
+        update, emitted once the folders are quiet for "debounce" ms, or at
+        most every "max_wait" ms while files keep coming. Rescans run in a
+        worker thread.
+        categories_changed is emitted when category folders were added or
+        removed. The collection root is watched for new categories only,
+        the files the index writes there are ignored.
+        File system events are unreliable on network shares, the displayed
+        category is also rescanned every "poll" ms ( sidecars are only
+        stat'ed ).
+    """
+    items_changed = QtCore.Signal(str, dict)
+    categories_changed = QtCore.Signal()
+
+    def __init__(self, collection_root, debounce=300, max_wait=2000,
+                 poll=30000, parent=None):
+        super(CollectionWatcher, self).__init__(parent)
+
+        self.collection_root = collection_root
+        self.max_wait = max_wait
+        self.pending = set()
+        self.first_event = None
+        self.folders_changed = False
+
+        # categories known by the index, new folders are detected against it
+        self.categories = set()
+
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directory_changed)
+        self.watcher.fileChanged.connect(self.file_changed)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce)
+        self.timer.timeout.connect(self.flush)
+
+        self.current_category = None
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.setInterval(poll)
+        self.poll_timer.timeout.connect(self.poll)
+        self.poll_timer.start()
+
+        self.worker = QtCore.QThread()
+        self.rescanner = RescanCategories(collection_root)
+        self.rescanner.items_changed.connect(self.items_changed)
+        self.rescanner.categories_changed.connect(self.update_categories)
+        self.rescanner.moveToThread(self.worker)
+        self.worker.start()
+
+        self.watch_folders(indexIO.get_index(collection_root).list_categories())
+
+    def __del__(self):
+
+        if self.worker.isRunning():
+            self.worker.quit()
+            self.worker.terminate()
+
+    def _category(self, path):
+
+        root = os.path.normpath(self.collection_root)
+        return os.path.normpath(path)[len(root):].replace(os.sep, '/')
+
+    def watch_folders(self, categories):
+        """ Watch the collection root and the folders of the given
+            categories, as listed by the index.
+        """
+        self.categories = set(categories)
+        folders = [self.collection_root]
+        for category in categories:
+            folders.append(indexIO.category_folder(self.collection_root, category))
+
+        watched = set(self.watcher.directories())
+        folders = [f for f in folders if f not in watched]
+        if folders:
+            self.watcher.addPaths(folders)
+
+    def _sub_folders_changed(self, path, category):
+        """ Return True if the sub folders of the given changed folder
+            differ from the known categories, a single folder is listed.
+        """
+        try:
+            current = set(d for d in os.listdir(path) \
+                          if not d.startswith('.') and \
+                          os.path.isdir(path + os.sep + d))
+        except OSError:
+            # the folder itself was removed
+            return True
+
+        known = set(c[len(category) + 1:] for c in self.categories \
+                    if c.rsplit('/', 1)[0] == category)
+        return current != known
+
+    def watch_category_files(self, category):
+        """ Watch the sidecars of the displayed category, folders events
+            don't catch metadata edited in place. Sidecars are listed from
+            the index, the folder itself isn't read.
+        """
+        self.current_category = category
+        files = self.watcher.files()
+        if files:
+            self.watcher.removePaths(files)
+
+        if not category:
+            return
+
+        files = indexIO.get_index(self.collection_root).sidecars(category)
+        if files:
+            self.watcher.addPaths(files)
+
+    def _schedule(self, category):
+
+        self.pending.add(category)
+        now = time.time()
+        if self.first_event is None:
+            self.first_event = now
+
+        # restart the debounce timer unless we already waited too long
+        if (now - self.first_event) * 1000.0 < self.max_wait \
+           or not self.timer.isActive():
+            self.timer.start()
+
+    @QtCore.Slot(str)
+    def directory_changed(self, path):
+
+        category = self._category(path)
+        folders_changed = self._sub_folders_changed(path, category)
+        self.folders_changed = self.folders_changed or folders_changed
+        if category:
+            self._schedule(category)
+        elif folders_changed:
+            self.timer.start()
+
+    @QtCore.Slot(str)
+    def file_changed(self, path):
+
+        self._schedule(self._category(os.path.dirname(path)))
+
+        # editors often replace the file, which removes it from the watcher
+        if os.path.exists(path) and path not in self.watcher.files():
+            self.watcher.addPath(path)
+
+    @QtCore.Slot()
+    def poll(self):
+
+        if self.current_category:
+            self._schedule(self.current_category)
+
+    @QtCore.Slot()
+    def flush(self):
+
+        self.first_event = None
+        folders_changed = self.folders_changed
+        self.folders_changed = False
+
+        pending = self.pending
+        self.pending = set()
+
+        self.rescanner.init_rescan.emit(sorted(pending), folders_changed)
+
+    @QtCore.Slot(list)
+    def update_categories(self, categories):
 
-        self.end_process.emit()
+        self.watch_folders(categories)
+        self.categories_changed.emit()
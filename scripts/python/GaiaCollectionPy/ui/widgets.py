@@ -3,11 +3,13 @@ import sys
 import os
 import tempfile
 import math
+import time
 import json
 import base64
 import datetime
 import getpass
 import hashlib
+import numpy as np
 
 from PySide2 import QtGui
 from PySide2 import QtCore
@@ -17,9 +19,23 @@ import toolutils
 from ..icons.icon import get_icon
 from . import ui_workers
 reload(ui_workers)
+from ..core import indexIO
+reload(indexIO)
+from ..core import thumbnailPack
+reload(thumbnailPack)
+from ..core import mipmaps
+reload(mipmaps)
+from ..core import sortKeys
+reload(sortKeys)
+from ..core import blobStore
+reload(blobStore)
+from ..core import localCache
+reload(localCache)
 from GaiaCommon import nodeInfos
 from GaiaCommon import h_widgets
 reload(h_widgets)
+from GaiaCommon import thumbnailCache
+reload(thumbnailCache)
 
 global FROM_GAIA_SCATTER
 FROM_GAIA_SCATTER = False
@@ -73,10 +89,31 @@ class CollectionWidget(QtWidgets.QFrame):
 
         self.setLayout(main_layout)
 
+        # live updates of the collection, pushed to the grid as deltas
+        self.watcher = ui_workers.CollectionWatcher(self.collection_root,
+                                                    parent=self)
+        self.watcher.items_changed.connect(self.assets_grid.apply_delta)
+
+        # categories counts and sizes follow the index updates
+        category_model = self.collection_menu.category_model
+        self.watcher.items_changed.connect(category_model.refresh_stats)
+        # the watcher already updated the categories of the index
+        self.watcher.categories_changed.connect(category_model.load)
+        self.assets_grid.getCollectionItems.end_process.connect(category_model.refresh_stats)
+        self.assets_grid.getCollectionItems.categories_changed.connect(category_model.load)
+
+        # sidecars of the displayed category are watched once it's indexed
+        self.assets_grid.getCollectionItems.end_process.connect(self.watch_displayed_files)
+
+    def watch_displayed_files(self, stats):
+
+        self.watcher.watch_category_files(self.assets_grid.current_category)
+
     def init_collection_folders(self):
         
         for f in os.listdir(self.collection_root):
-            if not os.path.isdir(self.collection_root + os.sep + f):
+            if f.startswith('.') or \
+               not os.path.isdir(self.collection_root + os.sep + f):
                 continue
 
             self.categories.append(f)
@@ -102,8 +139,143 @@ class CollectionToolbar(QtWidgets.QWidget):
         self.add_asset_btn.setIconSize(QtCore.QSize(25, 25))
         self.add_asset_btn.clicked.connect(self.add_entry)
         layout.addWidget(self.add_asset_btn)
+
+        self.refresh_btn = QtWidgets.QPushButton("")
+        self.refresh_btn.setToolTip("Re-index current category")
+        self.refresh_btn.setFixedHeight(32)
+        self.refresh_btn.setFixedWidth(32)
+        self.refresh_btn.setIcon(get_icon("import_database"))
+        self.refresh_btn.setIconSize(QtCore.QSize(25, 25))
+        self.refresh_btn.clicked.connect(self.refresh_category)
+        layout.addWidget(self.refresh_btn)
+
+        self.duplicates_btn = QtWidgets.QPushButton("")
+        self.duplicates_btn.setToolTip("Show duplicated assets of the whole collection")
+        self.duplicates_btn.setFixedHeight(32)
+        self.duplicates_btn.setFixedWidth(32)
+        self.duplicates_btn.setIcon(get_icon("clean"))
+        self.duplicates_btn.setIconSize(QtCore.QSize(25, 25))
+        self.duplicates_btn.clicked.connect(self.assets_grid.display_duplicates)
+        layout.addWidget(self.duplicates_btn)
+
+        self.search_w = QtWidgets.QLineEdit()
+        self.search_w.setPlaceholderText("Search collection...")
+        self.search_w.setToolTip(("Search the whole collection: words are AND'ed, "
+                                  "use OR, -word, prefix* and field:word "
+                                  "( name, comment, tag, category, by )"))
+        self.search_w.setFixedWidth(250)
+        self.search_w.returnPressed.connect(self.search)
+        layout.addWidget(self.search_w)
+
+        # filter of the displayed items, applied once typing pauses
+        self.filter_w = QtWidgets.QLineEdit()
+        self.filter_w.setPlaceholderText("Filter...")
+        self.filter_w.setToolTip("Filter the displayed items as you type")
+        self.filter_w.setFixedWidth(150)
+        self.filter_w.textChanged.connect(self.filter_changed)
+        layout.addWidget(self.filter_w)
+
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(150)
+        self.filter_timer.timeout.connect(self.apply_filter)
+
+        # sort / group of the displayed items, "Default" keeps the
+        # index order
+        fields = sorted(sortKeys.SORT_FIELDS)
+
+        self.sort_w = QtWidgets.QComboBox()
+        self.sort_w.setToolTip("Sort by")
+        self.sort_w.addItem("Default", None)
+        for field in fields:
+            self.sort_w.addItem(field.replace('_', ' ').capitalize(), field)
+        self.sort_w.currentIndexChanged.connect(self.sort_changed)
+        layout.addWidget(self.sort_w)
+
+        self.descending_btn = QtWidgets.QToolButton()
+        self.descending_btn.setToolTip("Descending order")
+        self.descending_btn.setCheckable(True)
+        self.descending_btn.setArrowType(QtCore.Qt.UpArrow)
+        self.descending_btn.toggled.connect(self.sort_changed)
+        layout.addWidget(self.descending_btn)
+
+        self.group_w = QtWidgets.QComboBox()
+        self.group_w.setToolTip("Group by")
+        self.group_w.addItem("No group", None)
+        for field in fields:
+            self.group_w.addItem(field.replace('_', ' ').capitalize(), field)
+        self.group_w.currentIndexChanged.connect(self.sort_changed)
+        layout.addWidget(self.group_w)
+
+        # local cache hit rate, only shown when the cache is enabled
+        self.cache_lbl = QtWidgets.QLabel("")
+        self.cache_lbl.setVisible(False)
+        layout.addWidget(self.cache_lbl)
+
+        self.cache_timer = QtCore.QTimer(self)
+        self.cache_timer.setInterval(2000)
+        self.cache_timer.timeout.connect(self.update_cache_stats)
+        self.cache_timer.start()
+        self.update_cache_stats()
+
         self.setLayout(layout)
 
+    def update_cache_stats(self):
+
+        cache = localCache.get_cache()
+        if cache is None:
+            self.cache_lbl.setVisible(False)
+            return
+
+        stats = cache.stats()
+        self.cache_lbl.setText("Cache: {0:.0%}".format(stats["hit_rate"]))
+        self.cache_lbl.setToolTip(("Local cache: {0}\n"
+                                   "{1} hit(s), {2} miss(es)\n"
+                                   "{3} file(s), {4} / {5}, {6} pinned").format(
+            cache.cache_root, stats["hits"], stats["misses"], stats["items"],
+            format_size(stats["bytes"]), format_size(stats["max_bytes"]),
+            stats["pinned"]))
+        self.cache_lbl.setVisible(True)
+
+    def sort_changed(self, *args):
+
+        descending = self.descending_btn.isChecked()
+        self.descending_btn.setArrowType(QtCore.Qt.DownArrow if descending \
+                                         else QtCore.Qt.UpArrow)
+        self.assets_grid.set_sort(self.sort_w.itemData(self.sort_w.currentIndex()),
+                                  descending,
+                                  self.group_w.itemData(self.group_w.currentIndex()))
+
+    def filter_changed(self, text):
+
+        self.filter_timer.start()
+
+    def apply_filter(self):
+
+        self.assets_grid.set_filter(self.filter_w.text())
+
+    def search(self):
+        """ Display the search results in the grid, an empty search
+            displays back the current category.
+        """
+        query = self.search_w.text().strip()
+        if query:
+            self.assets_grid.display_search(query)
+        elif self.collection_menu.current_category:
+            self.assets_grid.display_items(self.collection_menu.current_category)
+        else:
+            self.assets_grid.clear_entries()
+
+    def refresh_category(self):
+        """ Re-parse the sidecars of the current category and update
+            the collection index accordingly.
+        """
+        current_category = self.collection_menu.current_category
+        if not current_category:
+            return
+
+        self.assets_grid.refresh_items(current_category)
+
     def add_entry(self):
         """ Add the selected object to the collection and create
             metadata accordingly.
@@ -136,37 +308,398 @@ class CollectionToolbar(QtWidgets.QWidget):
         self.w.setStyleSheet(hou.ui.qtStyleSheet())
         self.w.show()
 
-class CollectionIconProvider(QtWidgets.QFileIconProvider):
+class CollectionItemsModel(QtCore.QAbstractListModel):
+    """ Assets displayed by the collection grid, thumbnails are requested
+        only when their row is painted by the view and decoded by the
+        thumbnail loader threads, a placeholder is painted meanwhile.
+        Sorting and grouping reorder the items in place from numpy key
+        columns, no index or widget is re-created.
+    """
+    MetadataRole = QtCore.Qt.UserRole + 1
+    GroupRole = QtCore.Qt.UserRole + 2
+
+    def __init__(self, collection_root, thumbnail_loader, parent=None):
+        super(CollectionItemsModel, self).__init__(parent=parent)
+
+        self.collection_root = collection_root
+        self.items = []
+        self.rows_by_uid = {}
+        self.drag_enabled = False
+
+        # in-memory index of the displayed items, used by the filter
+        self.search_index = None
+
+        # uids whose cache lookup was already counted, repaints don't count
+        # as hits, and uids without thumbnail, not requested again until
+        # they are updated
+        self.counted = set()
+        self.missing = set()
+
+        # sort keys of the displayed items per field, computed on first
+        # sort and dropped when items change
+        self.key_columns = {}
+        # arrival rank of every uid, the default order
+        self.ranks = {}
+        self.reordered = False
+        # { first row of a group: group label } when grouped
+        self.groups = {}
+
+        self.placeholder = QtGui.QPixmap(CollectionItemDelegate.ITEM_SIZE,
+                                         CollectionItemDelegate.ITEM_SIZE)
+        self.placeholder.fill(QtGui.QColor(58, 58, 58))
+
+        self.thumbnail_loader = thumbnail_loader
+        self.thumbnail_loader.thumbnail_ready.connect(self.thumbnail_ready)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+
+        if parent.isValid():
+            return 0
+        return len(self.items)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+
+        metadata = self.items[index.row()]
+        if role == QtCore.Qt.DecorationRole:
+            return self.thumbnail(metadata)
+        if role == self.MetadataRole:
+            return metadata
+        if role == self.GroupRole:
+            return self.groups.get(index.row())
+
+        return None
+
+    def flags(self, index):
 
-    def __init__(self):
-        super(CollectionIconProvider, self).__init__(self)
-   
+        flags = super(CollectionItemsModel, self).flags(index)
+        if index.isValid() and self.drag_enabled:
+            flags |= QtCore.Qt.ItemIsDragEnabled
+        return flags
 
-    def icon(self, info):
+    def mimeTypes(self):
+
+        return [indexIO.ASSET_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        """ Only the collection root and the uids of the dragged assets are
+            sent, the drop side resolves them through the collection index.
+        """
+        mime_data = QtCore.QMimeData()
+        rows = sorted(set(i.row() for i in indexes))
+        uids = [self.items[r]["uid"] for r in rows]
+        mime_data.setData(indexIO.ASSET_MIME_TYPE,
+                          indexIO.encode_asset_refs(self.collection_root, uids))
+        return mime_data
+
+    def supportedDragActions(self):
+
+        return QtCore.Qt.MoveAction
+
+    def thumbnail(self, metadata):
+
+        uid = metadata["uid"]
+        size = CollectionItemDelegate.ITEM_SIZE
+        if uid in self.missing or self.thumbnail_loader.is_pending(uid, size):
+            return self.placeholder
+
+        pixmap = thumbnailCache.get_cache().lookup(uid, size,
+                                                   count=uid not in self.counted)
+        self.counted.add(uid)
+        if pixmap is None:
+            self.thumbnail_loader.request(metadata, size)
+            return self.placeholder
+
+        return pixmap
+
+    @QtCore.Slot(str, int, QtGui.QImage)
+    def thumbnail_ready(self, uid, size, image):
+
+        row = self.rows_by_uid.get(uid)
+        if image.isNull():
+            if row is not None:
+                self.missing.add(uid)
+            return
+
+        thumbnailCache.get_cache().insert_image(uid, size, image)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def add_item(self, metadata):
+        """ Append the given asset, assets already displayed are ignored.
+            Return False if ignored.
+        """
+        return self.add_items([metadata]) > 0
+
+    def add_items(self, items):
+        """ Append a batch of assets with a single rows insertion, assets
+            already displayed are ignored. Return the number of added assets.
+        """
+        new_items = []
+        uids = set()
+        for metadata in items:
+            uid = metadata["uid"]
+            if uid in self.rows_by_uid or uid in uids:
+                continue
+            uids.add(uid)
+            metadata["collection_root"] = self.collection_root
+            new_items.append(metadata)
+
+        if not new_items:
+            return 0
+
+        row = len(self.items)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(new_items) - 1)
+        for i, metadata in enumerate(new_items):
+            self.items.append(metadata)
+            self.rows_by_uid[metadata["uid"]] = row + i
+            self.ranks.setdefault(metadata["uid"], len(self.ranks))
+            if self.search_index is not None:
+                self.search_index.add(metadata)
+        self.key_columns = {}
+        self.endInsertRows()
+
+        return len(new_items)
+
+    def update_item(self, metadata):
+        """ Replace the metadata of a displayed asset, its thumbnail is
+            reloaded on next paint.
+        """
+        row = self.rows_by_uid.get(metadata["uid"])
+        if row is None:
+            return self.add_item(metadata)
+
+        metadata["collection_root"] = self.collection_root
+        self.items[row] = metadata
+        self.key_columns = {}
+        thumbnailCache.get_cache().invalidate(metadata["uid"])
+        self.missing.discard(metadata["uid"])
+        if self.search_index is not None:
+            self.search_index.add(metadata)
+
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def remove_item(self, uid):
+
+        row = self.rows_by_uid.pop(uid, None)
+        if row is None:
+            return
+
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        self.items.pop(row)
+        self.key_columns = {}
+        if self.search_index is not None:
+            self.search_index.remove(uid)
+        for i in range(row, len(self.items)):
+            self.rows_by_uid[self.items[i]["uid"]] = i
+        self.endRemoveRows()
+
+    def metadata(self, row):
+
+        return self.items[row]
+
+    def key_column(self, field):
+
+        column = self.key_columns.get(field)
+        if column is None:
+            column = sortKeys.key_column(self.items, field)
+            self.key_columns[field] = column
+        return column
+
+    def sort_items(self, field, descending=False, group_by=None):
+        """ Reorder the items by the given metadata field, inside groups of
+            the group_by field if given. field None restores the order the
+            items were added in. Selection and persistent indexes follow
+            their items.
+        """
+        if not self.items or (field is None and group_by is None and \
+                              not self.reordered):
+            return
+
+        if field is None:
+            column = np.array([self.ranks[m["uid"]] for m in self.items])
+        else:
+            column = self.key_column(field)
 
-        return get_icon("database")
+        group_column = None
+        if group_by is not None:
+            group_column = sortKeys.group_column(self.key_column(group_by))
+        order = sortKeys.sort_order(column, descending, group_column)
+
+        self._apply_order(order)
+        self.reordered = field is not None or group_by is not None
+        if group_column is None:
+            self.set_groups({})
+        else:
+            self.set_groups(sortKeys.group_starts(group_column, order))
+
+    def _apply_order(self, order):
+
+        self.layoutAboutToBeChanged.emit()
+
+        # new row of every old row
+        new_rows = np.empty(len(order), dtype=np.int64)
+        new_rows[order] = np.arange(len(order))
+
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(int(new_rows[i.row()])) for i in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+
+        self.items = [self.items[i] for i in order]
+        self.rows_by_uid = dict((m["uid"], row) for row, m in enumerate(self.items))
+        self.key_columns = dict((field, column[order]) for field, column \
+                                in self.key_columns.items())
+
+        self.layoutChanged.emit()
+
+    def set_groups(self, groups):
+
+        if groups == self.groups:
+            return
+
+        self.groups = groups
+        if self.items:
+            self.dataChanged.emit(self.index(0), self.index(len(self.items) - 1))
+
+    def clear(self):
+
+        self.beginResetModel()
+        self.thumbnail_loader.cancel()
+        self.items = []
+        self.rows_by_uid = {}
+        self.search_index = None
+        self.counted = set()
+        self.missing = set()
+        self.key_columns = {}
+        self.ranks = {}
+        self.reordered = False
+        self.groups = {}
+        self.endResetModel()
+
+class CollectionFilterModel(QtCore.QSortFilterProxyModel):
+    """ Filter of the collection grid, accepted is the set of doc ids
+        of the source model search index matching the filter, None when
+        the grid isn't filtered.
+    """
+    def __init__(self, parent=None):
+        super(CollectionFilterModel, self).__init__(parent=parent)
+
+        self.accepted = None
+
+    def set_accepted(self, accepted):
+
+        self.accepted = accepted
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+
+        model = self.sourceModel()
+        if self.accepted is None or model.search_index is None:
+            return True
+
+        doc = model.search_index.docs.get(model.items[source_row]["uid"])
+        return doc in self.accepted
+
+class CollectionItemDelegate(QtWidgets.QStyledItemDelegate):
+    """ Paint an asset thumbnail of the collection grid, with a blue
+        border when selected. The first item of a group shows the group
+        label.
+    """
+    ITEM_SIZE = mipmaps.GRID_LEVEL
+
+    def sizeHint(self, option, index):
+
+        return QtCore.QSize(self.ITEM_SIZE, self.ITEM_SIZE)
+
+    def paint(self, painter, option, index):
+
+        painter.save()
+        rect = option.rect
+
+        pixmap = index.data(QtCore.Qt.DecorationRole)
+        if pixmap and not pixmap.isNull():
+            x = rect.x() + (rect.width() - pixmap.width()) // 2
+            y = rect.y() + (rect.height() - pixmap.height()) // 2
+            painter.drawPixmap(x, y, pixmap)
+
+        group = index.data(CollectionItemsModel.GroupRole)
+        if group is not None:
+            metrics = painter.fontMetrics()
+            label = metrics.elidedText(group, QtCore.Qt.ElideRight, rect.width() - 4)
+            label_rect = QtCore.QRect(rect.x(), rect.y(), rect.width(),
+                                      metrics.height() + 2)
+            painter.fillRect(label_rect, QtGui.QColor(0, 0, 0, 160))
+            painter.setPen(QtGui.QColor(230, 230, 230))
+            painter.drawText(label_rect.adjusted(2, 0, 0, 0),
+                             QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter, label)
+
+        if option.state & QtWidgets.QStyle.State_Selected:
+            painter.setPen(QtGui.QColor(0, 0, 255))
+        else:
+            painter.setPen(QtGui.QColor(0, 0, 0))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+
+        painter.restore()
 
 class CollectionGrid(QtWidgets.QFrame):
 
-    def __init__(self, collection_root, parent=None):
+    # neighbour categories are prefetched once the grid is idle for
+    # PREFETCH_DELAY ms, up to PREFETCH_MAX_BYTES of decoded thumbnails
+    PREFETCH_DELAY = 500
+    PREFETCH_MAX_BYTES = 24 * 1024 * 1024
+
+    def __init__(self, collection_root, max_workers=indexIO.DEFAULT_WORKERS,
+                 parent=None):
         super(CollectionGrid, self).__init__(parent=parent)
 
+        global FROM_GAIA_SCATTER
         self.setProperty("houdiniStyle", True)
 
-        self.collection_items = []
-        self.selected_item = None
         self.item_properties = parent.asset_properties
         self.collection_root = collection_root
+        self.current_category = None
+        self.populate_start = 0.0
+        self.filter_text = ""
+
+        # ( field, descending, group_by ) of the displayed items
+        self.sort_spec = (None, False, None)
+
+        # duplicates are displayed by group, not sorted
+        self.showing_duplicates = False
 
         # worker thread used by item parsing
         self.worker = QtCore.QThread()
-        self.getCollectionItems = ui_workers.GetCollectionItems()
-        self.getCollectionItems.add_entry.connect(self.add_entry)
+        self.getCollectionItems = ui_workers.GetCollectionItems(collection_root,
+                                                                max_workers)
+        self.getCollectionItems.add_entries.connect(self.add_entries)
+        self.getCollectionItems.filter_index.connect(self.set_filter_index)
         self.getCollectionItems.start_process.connect(self.start_process)
         self.getCollectionItems.end_process.connect(self.end_process)
         self.getCollectionItems.moveToThread(self.worker)
         self.worker.start()
 
+        # duplicates search, hashing thumbnails can take a while
+        self.duplicates_finder = ui_workers.DuplicatesFinder(collection_root,
+                                                             parent=self)
+        self.duplicates_finder.groups_ready.connect(self.add_duplicates)
+
+        # low priority thread used by neighbour categories prefetch
+        self.prefetch_worker = QtCore.QThread()
+        self.prefetcher = ui_workers.CategoryPrefetcher(collection_root,
+                                                        CollectionItemDelegate.ITEM_SIZE)
+        self.prefetcher.moveToThread(self.prefetch_worker)
+        self.prefetch_worker.start(QtCore.QThread.LowestPriority)
+
+        self.prefetch_timer = QtCore.QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(self.PREFETCH_DELAY)
+        self.prefetch_timer.timeout.connect(self.prefetch)
+
         self.setObjectName("grid")
         self.setFixedWidth(415)
         main_layout = QtWidgets.QVBoxLayout()
@@ -181,16 +714,33 @@ class CollectionGrid(QtWidgets.QFrame):
 
         self.setStyleSheet("""QFrame#grid{border: 1px solid black}""")
 
-        self.scrollarea = QtWidgets.QScrollArea()
-        self.scrollarea.setStyleSheet("""QScrollArea{background-color: transparent}""")
-        self.scrollarea.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOn)
-        self.scroll_widget = QtWidgets.QWidget()
-        self.asset_grid_layout = QtWidgets.QGridLayout()
-        self.asset_grid_layout.setAlignment(QtCore.Qt.AlignTop)
-        self.scroll_widget.setLayout(self.asset_grid_layout)
-        self.scrollarea.setWidgetResizable(True)
-        self.scrollarea.setWidget(self.scroll_widget)
-        main_layout.addWidget(self.scrollarea)
+        # only the visible items are painted, whatever the category size
+        self.thumbnail_loader = ui_workers.ThumbnailLoader(collection_root,
+                                                           parent=self)
+        self.model = CollectionItemsModel(collection_root, self.thumbnail_loader,
+                                          parent=self)
+        self.model.drag_enabled = FROM_GAIA_SCATTER
+        self.prefetcher.thumbnail_ready.connect(self.model.thumbnail_ready)
+
+        self.proxy = CollectionFilterModel(self)
+        self.proxy.setSourceModel(self.model)
+
+        self.view = QtWidgets.QListView()
+        self.view.setStyleSheet("""QListView{background-color: transparent}""")
+        self.view.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOn)
+        self.view.setViewMode(QtWidgets.QListView.IconMode)
+        self.view.setMovement(QtWidgets.QListView.Static)
+        self.view.setResizeMode(QtWidgets.QListView.Adjust)
+        self.view.setUniformItemSizes(True)
+        self.view.setSpacing(4)
+        self.view.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.view.setItemDelegate(CollectionItemDelegate(self.view))
+        self.view.setModel(self.proxy)
+        if FROM_GAIA_SCATTER:
+            self.view.setDragEnabled(True)
+            self.view.setDragDropMode(QtWidgets.QAbstractItemView.DragOnly)
+        self.view.selectionModel().selectionChanged.connect(self.selection_changed)
+        main_layout.addWidget(self.view)
 
         self.setLayout(main_layout)
 
@@ -199,12 +749,90 @@ class CollectionGrid(QtWidgets.QFrame):
         if self.worker.isRunning():
             self.worker.quit()
             self.worker.terminate()
+
+        self.prefetcher.cancel = True
+        if self.prefetch_worker.isRunning():
+            self.prefetch_worker.quit()
+            self.prefetch_worker.terminate()
     
-    def display_items(self, collection_folder):
+    def display_items(self, category):
+        """ Display the items of the given category, fetched from the
+            collection index.
+        """
+        self.stop_prefetch()
+        self.clear_entries()
+        self.cancel_duplicates()
+        self.current_category = category
+        self.populate_start = time.time()
+        self.getCollectionItems.cancel = True
+        self.getCollectionItems.init_run.emit(category)
+
+    def refresh_items(self, category):
+        """ Re-parse the sidecars of the given category in the worker
+            thread, then display its items.
+        """
+        self.stop_prefetch()
+        self.clear_entries()
+        self.cancel_duplicates()
+        self.current_category = category
+        self.populate_start = time.time()
+        self.getCollectionItems.cancel = True
+        self.getCollectionItems.init_refresh.emit(category)
 
+    def display_search(self, query):
+        """ Display the items of the whole collection matching the query.
+        """
+        self.stop_prefetch()
         self.clear_entries()
+        self.cancel_duplicates()
+        self.current_category = None
+        self.populate_start = time.time()
+        self.getCollectionItems.cancel = True
+        self.getCollectionItems.init_search.emit(query)
+
+    def display_duplicates(self):
+        """ Display the groups of duplicated assets of the whole collection,
+            detected from their thumbnails, see duplicates.find_duplicates().
+            Thumbnails not hashed yet are hashed first, in a worker thread.
+        """
+        self.stop_prefetch()
         self.getCollectionItems.cancel = True
-        self.getCollectionItems.init_run.emit(collection_folder)
+        self.clear_entries()
+        self.showing_duplicates = True
+        self.current_category = None
+        self.populate_start = time.time()
+
+        # busy until the groups are received
+        self.items_loading_progress.setMinimum(0)
+        self.items_loading_progress.setMaximum(0)
+        self.duplicates_finder.request()
+
+    def cancel_duplicates(self):
+
+        if self.showing_duplicates:
+            self.showing_duplicates = False
+            self.duplicates_finder.cancel()
+            self.items_loading_progress.setMaximum(1)
+
+    @QtCore.Slot(list, object)
+    def add_duplicates(self, groups, search_index):
+
+        self.items_loading_progress.setMaximum(1)
+        self.items_loading_progress.setValue(0)
+
+        items = []
+        labels = {}
+        for i, group in enumerate(groups):
+            labels[len(items)] = "Duplicates {0} ( {1} )".format(i + 1, len(group))
+            items.extend(group)
+
+        self.model.add_items(items)
+        self.model.set_groups(labels)
+        self.set_filter_index(search_index)
+
+        self.items_loading_progress.setToolTip(
+            "{0} duplicated item(s) in {1} group(s), found in {2:.3f}s".format(
+                len(items), len(labels), time.time() - self.populate_start))
 
     @QtCore.Slot(int)
     def start_process(self, val):
@@ -213,11 +841,45 @@ class CollectionGrid(QtWidgets.QFrame):
         self.items_loading_progress.setMaximum(val)
         self.items_loading_progress.setValue(0)
 
-    @QtCore.Slot()
-    def end_process(self):
+    @QtCore.Slot(dict)
+    def end_process(self, stats):
         
         self.items_loading_progress.setValue(0)
 
+        # time to fully populate the grid, from the request to the last item
+        tooltip = "{0} item(s) displayed in {1:.3f}s".format(
+            self.model.rowCount(), time.time() - self.populate_start)
+        if stats.get("files"):
+            tooltip += ("\n{0} file(s) parsed in {1:.2f}s: {2:.1f} files/s, "
+                        "{3:.2f} MB/s").format(stats["files"], stats["elapsed"],
+                                               stats["files_per_sec"],
+                                               stats["mb_per_sec"])
+        self.items_loading_progress.setToolTip(tooltip)
+
+        self.apply_sort()
+
+        if self.current_category:
+            self.prefetch_timer.start()
+
+    def prefetch(self):
+        """ Warm up the neighbour categories of the displayed one, the
+            prefetch never evicts thumbnails already cached.
+        """
+        if not self.current_category:
+            return
+
+        cache = thumbnailCache.get_cache()
+        budget = min(self.PREFETCH_MAX_BYTES, cache.max_bytes - cache.nbytes)
+        if budget > 0:
+            self.prefetcher.init_prefetch.emit(self.current_category, budget,
+                                               cache.keys())
+
+    def stop_prefetch(self):
+        """ Foreground loads always take precedence over the prefetch.
+        """
+        self.prefetch_timer.stop()
+        self.prefetcher.cancel = True
+
     @QtCore.Slot()
     def cancel_process(self):
 
@@ -226,38 +888,317 @@ class CollectionGrid(QtWidgets.QFrame):
     @QtCore.Slot(dict)
     def add_entry(self, metadata):
         
-        w = CollectionItem(metadata=metadata, collection_root=self.collection_root,
-                           parent=self)
-        nitems = len(self.collection_items)
+        self.model.add_item(metadata)
 
-        col = 0
-        row = 0
-        if nitems > 0: 
-            
-            col = nitems % 4
-            row = nitems / 4
+        val = self.items_loading_progress.value()
+        self.items_loading_progress.setValue(val + 1)
 
-        self.asset_grid_layout.addWidget(w, row, col)
-        self.collection_items.append(w)
+    @QtCore.Slot(list)
+    def add_entries(self, items):
+        """ Insert a batch of items sent by the worker, one rows insertion
+            and one progress update per batch.
+        """
+        self.model.add_items(items)
 
         val = self.items_loading_progress.value()
-        self.items_loading_progress.setValue(val + 1)
+        self.items_loading_progress.setValue(val + len(items))
+
+    def selection_changed(self, selected, deselected):
+
+        indexes = self.view.selectionModel().selectedIndexes()
+        if not indexes:
+            self.item_properties.reset()
+            return
+
+        # several items can be selected to be dragged at once, the
+        # current one is displayed
+        current = self.view.currentIndex()
+        if current not in indexes:
+            current = indexes[0]
+        current = self.proxy.mapToSource(current)
+        self.item_properties.update_entry(self.model.metadata(current.row()))
+
+    def set_filter(self, text):
+        """ Narrow the displayed items to the ones matching text, words are
+            matched as prefixes and support the search syntax. The query runs
+            on the in-memory index of the displayed items only.
+        """
+        self.filter_text = text.strip()
+        self.apply_filter()
+
+    def apply_filter(self):
+
+        search_index = self.model.search_index
+        if not self.filter_text or search_index is None:
+            self.proxy.set_accepted(None)
+            return
+
+        words = []
+        for word in self.filter_text.split():
+            if word not in ("OR", "NOT", "-") and not word.endswith('*'):
+                word += '*'
+            words.append(word)
+
+        try:
+            accepted = search_index.match(' '.join(words))
+        except ValueError:
+            # incomplete field name while typing
+            return
+
+        self.proxy.set_accepted(accepted)
+
+    @QtCore.Slot(object)
+    def set_filter_index(self, search_index):
+
+        self.model.search_index = search_index
+        if self.filter_text:
+            self.apply_filter()
+
+    @QtCore.Slot(str, dict)
+    def apply_delta(self, category, delta):
+        """ Update only the changed items of the displayed category,
+            delta comes from the collection watcher.
+        """
+        if category != self.current_category:
+            return
+
+        index = indexIO.get_index(self.collection_root)
+        for uid in delta["removed"]:
+            self.model.remove_item(uid)
+
+        for uid in delta["modified"] + delta["added"]:
+            metadata = index.get_item(uid)
+            if metadata:
+                self.model.update_item(metadata)
+
+        self.apply_sort()
+        if self.filter_text:
+            self.apply_filter()
+
+    def set_sort(self, field, descending=False, group_by=None):
+        """ Sort the displayed items by the given metadata field, see
+            sortKeys.SORT_FIELDS, and group them by group_by if given.
+            Items loaded later are sorted once the grid is populated.
+        """
+        self.sort_spec = (field, descending, group_by)
+        self.apply_sort()
+
+    def apply_sort(self):
+
+        if self.showing_duplicates:
+            return
+
+        field, descending, group_by = self.sort_spec
+        self.model.sort_items(field, descending, group_by)
 
     def clear_entries(self):
 
-        for i in range(self.asset_grid_layout.count())[::-1]:
-            
-            it = self.asset_grid_layout.itemAt(i)
-            if it:
-                w = it.widget()
-                self.asset_grid_layout.removeWidget(w)
-                w.setParent(None)
-                w.deleteLater()
-
-        self.collection_items = []
-        self.selected_item = None
+        self.proxy.set_accepted(None)
+        self.model.clear()
         self.item_properties.reset()
 
+def format_size(nbytes):
+
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024.0 or unit == "GB":
+            break
+        nbytes /= 1024.0
+
+    if unit == "B":
+        return "{0} B".format(int(nbytes))
+    return "{0:.1f} {1}".format(nbytes, unit)
+
+class CategoryNode(object):
+
+    __slots__ = ["name", "category", "parent", "row", "children"]
+
+    def __init__(self, category, parent=None, row=0):
+
+        self.category = category
+        self.name = category.rsplit('/', 1)[-1]
+        self.parent = parent
+        self.row = row
+        # None until fetched
+        self.children = None
+
+class CategoryTreeModel(QtCore.QAbstractItemModel):
+    """ Tree of the collection categories fed from the collection index,
+        with the assets count and the geometry files size of each category
+        ( children included ). Child nodes are created when their parent is
+        expanded, navigating never touches the file system.
+    """
+    CategoryRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self, collection_root, parent=None):
+        super(CategoryTreeModel, self).__init__(parent=parent)
+
+        self.collection_root = collection_root
+        self.icon = get_icon("database")
+        self.root = CategoryNode("")
+        self.categories = []
+        self.sub_categories = {}
+        self.stats = {}
+        self.complete = {}
+
+        self.load()
+
+    def load(self, rescan=False):
+        """ Read the categories from the index, the folders are walked again
+            if rescan is True. The tree is reset only if categories changed.
+        """
+        categories = indexIO.get_index(self.collection_root).list_categories(rescan)
+        if categories == self.categories:
+            return
+
+        self.beginResetModel()
+        self.categories = categories
+        self.sub_categories = {}
+        for category in categories:
+            parent = category.rsplit('/', 1)[0]
+            self.sub_categories.setdefault(parent, []).append(category)
+
+        self.root = CategoryNode("")
+        self._update_stats()
+        self.endResetModel()
+
+    def _update_stats(self):
+
+        index_stats = indexIO.get_index(self.collection_root).category_stats()
+
+        stats = {}
+        for category, (count, nbytes) in index_stats.items():
+            while category:
+                s = stats.setdefault(category, [0, 0])
+                s[0] += count
+                s[1] += nbytes
+                category = category.rsplit('/', 1)[0]
+
+        # deepest first, a category is complete when its whole
+        # sub tree is indexed
+        complete = {}
+        for category in sorted(self.categories, key=lambda c: -c.count('/')):
+            complete[category] = category in index_stats and \
+                all(complete.get(c, False) for c in self.sub_categories.get(category, []))
+
+        self.stats = stats
+        self.complete = complete
+
+    def refresh_stats(self, *args):
+        """ Update the counts and sizes displayed, e.g. once a category
+            is indexed.
+        """
+        self._update_stats()
+
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if not node.children:
+                continue
+            first = self.createIndex(0, 0, node.children[0])
+            last = self.createIndex(len(node.children) - 1, 0, node.children[-1])
+            self.dataChanged.emit(first, last)
+            nodes.extend(node.children)
+
+    def _node(self, index):
+
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+
+        node = self._node(parent)
+        if node.children is None or row < 0 or row >= len(node.children):
+            return QtCore.QModelIndex()
+
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        node = index.internalPointer().parent
+        if node is None or node is self.root:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(node.row, 0, node)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return 0
+
+        node = self._node(parent)
+        return len(node.children) if node.children is not None else 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+
+        return bool(self.sub_categories.get(self._node(parent).category))
+
+    def canFetchMore(self, parent):
+
+        node = self._node(parent)
+        return node.children is None and \
+               bool(self.sub_categories.get(node.category))
+
+    def fetchMore(self, parent):
+
+        node = self._node(parent)
+        if node.children is not None:
+            return
+
+        categories = self.sub_categories.get(node.category, [])
+        if not categories:
+            node.children = []
+            return
+
+        self.beginInsertRows(parent, 0, len(categories) - 1)
+        node.children = [CategoryNode(c, node, i) for i, c in enumerate(categories)]
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+
+        node = index.internalPointer()
+        if role == self.CategoryRole:
+            return node.category
+
+        if role == QtCore.Qt.DecorationRole:
+            return self.icon
+
+        stats = self.stats.get(node.category)
+        complete = self.complete.get(node.category, False)
+
+        if role == QtCore.Qt.DisplayRole:
+            if stats is None:
+                return node.name
+            return "{0} ({1}{2})".format(node.name, stats[0],
+                                        "" if complete else "+")
+
+        if role == QtCore.Qt.ToolTipRole:
+            if stats is None:
+                return node.category + "\nNot indexed yet"
+            tooltip = "{0}\n{1} asset(s), {2}".format(node.category, stats[0],
+                                                     format_size(stats[1]))
+            if not complete:
+                tooltip += "\nSub categories not all indexed yet"
+            return tooltip
+
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return "Folders"
+        return None
+
 class CollectionMenu(QtWidgets.QTreeView):
     """ Left side menu to navigate throught the collection
     """
@@ -277,31 +1218,21 @@ class CollectionMenu(QtWidgets.QTreeView):
         self.current_category = None
         self.collection_root = collection_root
 
-        self.filemodel = QtWidgets.QFileSystemModel(self)
-        self.filemodel.setIconProvider(CollectionIconProvider())
-        
-        self.filemodel.setFilter(QtCore.QDir.AllDirs|QtCore.QDir.NoDotAndDotDot)
-
-        r = self.filemodel.setRootPath(collection_root)
-        self.filemodel.setHeaderData(0, QtCore.Qt.Horizontal, "Folders");
-        self.setModel(self.filemodel)
-        self.setRootIndex(r)
-        
-        for i in range(self.header().count()):
-
-            if i == 0: continue
-            self.hideColumn(i)
+        self.category_model = CategoryTreeModel(collection_root, self)
+        self.setModel(self.category_model)
 
         self.header().close()
 
     def selectionChanged(self, selected, deselected):
         
-        try:
-            items_path_root = self.filemodel.filePath(self.currentIndex())
-            self.current_category = items_path_root.replace(os.sep, '/').replace(self.collection_root.replace(os.sep, '/'), '')
-            self.collection.assets_grid.display_items(items_path_root)
-        except AttributeError:
-            pass
+        category = self.category_model.data(self.currentIndex(),
+                                            CategoryTreeModel.CategoryRole)
+        if category:
+            self.current_category = category
+            try:
+                self.collection.assets_grid.display_items(self.current_category)
+            except AttributeError:
+                pass
         super(CollectionMenu, self).selectionChanged(selected, deselected)
         
 class CollectionItemProperties(QtWidgets.QWidget):
@@ -384,6 +1315,8 @@ class CollectionItemProperties(QtWidgets.QWidget):
             name = metadata["name"]
             _format = metadata["format"]
             _path = metadata["path"].replace('\\', '/') + '/' + name + '.' + _format
+            if metadata.get("blob"):
+                _path = blobStore.blob_path("%ROOT%", metadata["blob"]).replace('\\', '/')
             comment = metadata["comment"]
             tags = metadata["tags"]
             _type = metadata["type"]
@@ -395,7 +1328,8 @@ class CollectionItemProperties(QtWidgets.QWidget):
             self.item_name_w.setText("Name: " + name)
             self.item_format.setText("Format: " + _format)
             self.item_path_w.setText("Path: " + _path)
-            self.item_path = _path.replace("%ROOT%", self.collection_root.replace('\\', '/'))
+            self.item_path = indexIO.geometry_path(self.collection_root,
+                                                   metadata).replace('\\', '/')
             self.item_infos.setText(comment)
             self.tags_w.setText("Tags: " + ', '.join(tags))
             self.item_npoints.setText("Points: " + str(npoints))
@@ -454,62 +1388,8 @@ class CollectionItemProperties(QtWidgets.QWidget):
         geo = hou.node("/obj").createNode("geo", self.metadata["name"])
         f = hou.node(geo.path() + "/file1")
         f.setName("import_" + self.metadata["name"])
-        f.parm("file").set(self.item_path)
-
-class CollectionItem(QtWidgets.QLabel):
-
-    def __init__(self, metadata=None, collection_root="", parent=None):
-        super(CollectionItem, self).__init__(parent=parent)
-
-        global FROM_GAIA_SCATTER
-        self.from_gaia_scatter = FROM_GAIA_SCATTER
-        self.setProperty("houdiniStyle", True)
-
-        self.is_selected = False
-        self.metadata = metadata
-        self.collection_grid = parent
-        self.metadata["collection_root"] = collection_root
-        self.setMouseTracking(True)
-
-        self.setFixedSize(QtCore.QSize(85, 85))
-
-        pixdata = self.metadata["thumbnail"]
-        pixmap = QtGui.QPixmap()
-        pixmap.loadFromData(base64.decodestring(pixdata))
-        pixmap = pixmap.scaledToHeight(85, QtCore.Qt.TransformationMode.SmoothTransformation)
-
-        self.setPixmap(pixmap)
-
-        self.setStyleSheet("""QLabel{border: 1px solid black;}""")
-
-    def mousePressEvent(self, event):
-
-        self.collection_grid.item_properties.update_entry(self.metadata)
-
-        cur_item = self.collection_grid.selected_item
-        if cur_item:
-            cur_item.setStyleSheet("""QLabel{border: 1px solid black}""")
-            cur_item.is_selected = False
-
-        if self.is_selected:
-            self.is_selected = False
-            self.setStyleSheet("""QLabel{border: 1px solid black}""")
-        else:
-            self.is_selected = True
-            self.setStyleSheet("""QLabel{border: 1px solid blue}""")
-
-        self.collection_grid.selected_item = self
-
-        if self.from_gaia_scatter:
-            mimeData = QtCore.QMimeData()
-            mimeData.setText(str(self.metadata))
-            drag = QtGui.QDrag(self)
-            drag.setPixmap(self.pixmap())
-            drag.setMimeData(mimeData)
-            drag.setHotSpot(event.pos() - self.rect().topLeft())
-            drag.start(QtCore.Qt.MoveAction)
-        
-        super(CollectionItem, self).mousePressEvent(event)
+        f.parm("file").setExpression(localCache.local_path_expression(self.item_path),
+                                     hou.exprLanguage.Python)
 
 class CreateNewEntryWidget(QtWidgets.QFrame):
 
@@ -794,15 +1674,30 @@ class CreateNewEntryWidget(QtWidgets.QFrame):
         # unique ID
         metadata["uid"] = hashlib.sha1(self.current_category + os.sep + name).hexdigest()
 
-        metadata["thumbnail"] = base64.b64encode(self.thumbnail_data)
-
-        # save geometry
-        self.obj_geo.saveToFile(_path + os.sep + name + "." + format)
+        # thumbnail is stored in the collection pack, sidecar keeps a reference
+        collection_root = hou.session.GAIA_COLLECTION_ROOT
+        thumbnailPack.get_pack(collection_root).write(metadata["uid"],
+                                                      self.thumbnail_data)
+        mipmaps.write_levels(collection_root, metadata["uid"], self.thumbnail_data)
+        metadata["thumbnail_ref"] = thumbnailPack.PACK_REF
+
+        # save geometry, deduplicated when the collection uses the
+        # content-addressed store
+        if blobStore.is_enabled(collection_root):
+            tmp = _path + os.sep + name + ".tmp." + format
+            self.obj_geo.saveToFile(tmp)
+            metadata["blob"] = blobStore.store(collection_root, tmp, format,
+                                               move=True)
+        else:
+            self.obj_geo.saveToFile(_path + os.sep + name + "." + format)
 
         # save metadata
-        with open(_path + os.sep + name + ".json", 'wb') as f:
+        sidecar = _path + os.sep + name + ".json"
+        with open(sidecar, 'wb') as f:
             json.dump(metadata, f, indent=4)
 
+        indexIO.get_index(collection_root).add_item(metadata, sidecar)
+
         self.assets_grid.add_entry(metadata)
         hou.ui.displayMessage("Asset created: " + name)
 
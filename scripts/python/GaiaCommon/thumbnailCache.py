@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+from PySide2 import QtGui
+from PySide2 import QtCore
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+try:
+    _CACHE
+except NameError:
+    _CACHE = None
+
+def get_cache():
+    """ Return the thumbnail cache shared by the collection browser and
+        the scatter tools for the whole session.
+    """
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ThumbnailCache()
+
+    return _CACHE
+
+def pixmap_bytes(pixmap):
+
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+class ThumbnailCache(object):
+    """ LRU cache of decoded and scaled thumbnails, keyed by ( uid, size ).
+        When the memory used by the cached pixmaps goes over max_bytes the
+        least recently used ones are evicted. Must be used from the UI
+        thread only ( QPixmap ).
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pixmaps = OrderedDict()
+
+    def __contains__(self, key):
+
+        return key in self._pixmaps
+
+    def __len__(self):
+
+        return len(self._pixmaps)
+
+    def keys(self):
+        """ Return the set of cached ( uid, size ), a copy that can be
+            handed to worker threads.
+        """
+        return set(self._pixmaps)
+
+    def lookup(self, uid, size, count=True):
+        """ Return the cached pixmap of the given uid and size, None
+            on miss. count is False for lookups that can't avoid a decode,
+            e.g. repaints, they don't change the hit rate.
+        """
+        key = (uid, size)
+        pixmap = self._pixmaps.pop(key, None)
+        if pixmap is None:
+            if count:
+                self.misses += 1
+            return None
+
+        self._pixmaps[key] = pixmap
+        if count:
+            self.hits += 1
+        return pixmap
+
+    def get(self, uid, size, loader):
+        """ Return the pixmap of the given uid scaled to "size" height,
+            on miss loader() is called to get the raw image data
+            ( jpg bytes or None ). A null pixmap is returned, and not
+            cached, when there is no thumbnail.
+        """
+        pixmap = self.lookup(uid, size)
+        if pixmap is not None:
+            return pixmap
+
+        pixmap = QtGui.QPixmap()
+        data = loader()
+        if data and pixmap.loadFromData(data) and pixmap.height() != size:
+            pixmap = pixmap.scaledToHeight(size, QtCore.Qt.SmoothTransformation)
+
+        self.insert(uid, size, pixmap)
+        return pixmap
+
+    def insert(self, uid, size, pixmap):
+        """ Cache the given pixmap, null pixmaps are ignored: a thumbnail
+            added later is loaded on next request.
+        """
+        if pixmap.isNull():
+            return
+
+        key = (uid, size)
+        old = self._pixmaps.pop(key, None)
+        if old is not None:
+            self.nbytes -= pixmap_bytes(old)
+
+        self._pixmaps[key] = pixmap
+        self.nbytes += pixmap_bytes(pixmap)
+        self._evict()
+
+    def insert_image(self, uid, size, image):
+        """ Convert the given QImage, decoded in a worker thread, and
+            cache it. Return the pixmap.
+        """
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self.insert(uid, size, pixmap)
+        return pixmap
+
+    def invalidate(self, uid):
+        """ Remove every size of the given uid, e.g. when its thumbnail
+            is updated.
+        """
+        for key in [k for k in self._pixmaps if k[0] == uid]:
+            self.nbytes -= pixmap_bytes(self._pixmaps.pop(key))
+
+    def set_max_bytes(self, max_bytes):
+
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+
+        while self.nbytes > self.max_bytes and len(self._pixmaps) > 1:
+            _, pixmap = self._pixmaps.popitem(last=False)
+            self.nbytes -= pixmap_bytes(pixmap)
+
+    def clear(self):
+
+        self._pixmaps.clear()
+        self.nbytes = 0
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0,
+                "items": len(self._pixmaps), "bytes": self.nbytes,
+                "max_bytes": self.max_bytes}
@@ -0,0 +1,104 @@
+import sqlite3
+import hou
+
+from . import cache
+reload(cache)
+
+from GaiaCollectionPy.core import usageIndex
+reload(usageIndex)
+
+LAYER_TYPES = ("Gaia_Paint_Scatter_Layer", "Gaia_Fill_Scatter_Layer")
+
+def _layer_assets(layer_node):
+    """ Return { collection root: [ uids ] } of the instances of the
+        given scatter layer node.
+    """
+    assets = {}
+    for i in range(layer_node.evalParm("instances")):
+        i = str(i + 1)
+        root = layer_node.evalParm("collection_root_" + i).replace('\\', '/')
+        uid = layer_node.evalParm("asset_uid_" + i)
+        if root and uid:
+            assets.setdefault(root, []).append(uid)
+
+    return assets
+
+def record_layer(layer_node, previous_roots=()):
+    """ Record the assets used by the given Gaia scatter layer node in the
+        usage index of their collections, called when the layer instances
+        change. previous_roots are collections the layer may not use
+        anymore. Nothing is recorded for an unsaved scene, its layers are
+        recorded when it is first saved.
+    """
+    if hou.hipFile.isNewFile():
+        return
+
+    assets = _layer_assets(layer_node)
+    for root in previous_roots:
+        assets.setdefault(root.replace('\\', '/'), [])
+
+    scatter = cache.get("CURRENT_GAIA_SCATTER")
+    if not isinstance(scatter, str):
+        scatter = None
+
+    hip = hou.hipFile.path()
+    hou.session.GAIA_USAGE_HIP = hip
+    for root, uids in assets.items():
+        try:
+            usageIndex.get_usage_index(root).set_layer(hip, layer_node.path(),
+                                                       uids, scatter)
+        except sqlite3.Error as e:
+            print("Warning: can't record assets usage of {}: {}".format(root, e))
+
+def forget_layer(layer_node):
+    """ Remove the usage of the given layer node, before it is deleted.
+    """
+    if hou.hipFile.isNewFile():
+        return
+
+    hip = hou.hipFile.path()
+    for root in _layer_assets(layer_node):
+        try:
+            usageIndex.get_usage_index(root).set_layer(hip, layer_node.path(), [])
+        except sqlite3.Error as e:
+            print("Warning: can't record assets usage of {}: {}".format(root, e))
+
+def record_scene():
+    """ Record the assets used by every Gaia scatter layer of the scene.
+    """
+    for scatter in hou.node("/obj").children():
+
+        if scatter.type().name() != "Gaia_Scatter":
+            continue
+
+        layers = scatter.node("LAYERS")
+        if layers is None:
+            continue
+
+        for layer_node in layers.children():
+            if layer_node.type().name() in LAYER_TYPES:
+                record_layer(layer_node)
+
+def _hip_saved(event_type):
+
+    # first save of a new scene or save as, the layers are recorded under
+    # the new hip path
+    if event_type == hou.hipFileEventType.AfterSave and \
+       hou.hipFile.path() != getattr(hou.session, "GAIA_USAGE_HIP", None):
+        record_scene()
+
+def watch_hip_saves():
+    """ Register the hip file save callback once per session, the callback
+        of a previously loaded version of this module is replaced.
+    """
+    previous = getattr(hou.session, "GAIA_USAGE_SAVE_CALLBACK", None)
+    if previous is not None:
+        try:
+            hou.hipFile.removeEventCallback(previous)
+        except hou.OperationFailed:
+            pass
+
+    hou.hipFile.addEventCallback(_hip_saved)
+    hou.session.GAIA_USAGE_SAVE_CALLBACK = _hip_saved
+
+watch_hip_saves()
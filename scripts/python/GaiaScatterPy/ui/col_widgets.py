@@ -10,10 +10,20 @@ import toolutils
 
 from ..icons.icon import get_icon
 from GaiaCommon import nodeInfos
+from GaiaCommon import thumbnailCache
+reload(thumbnailCache)
+
+from GaiaCollectionPy.core import mipmaps
+from GaiaCollectionPy.core import indexIO
 
 from . import widgets
 reload(widgets)
 
+from ..core import usage
+reload(usage)
+
+THUMBNAIL_SIZE = mipmaps.INSTANCE_LEVEL
+
 class CollectionInstanceWidget(QtWidgets.QWidget):
     """ Widget used in the layer widget, when object are dropped from the collection
         to the scatter tool.
@@ -43,6 +53,7 @@ class CollectionInstanceWidget(QtWidgets.QWidget):
             self.layer_node.parm("category_" + str(self.idx)).set(self.asset_category)
             self.layer_node.parm("asset_uid_" + str(self.idx)).set(self.uid)
             self.layer_node.parm("collection_root_" + str(self.idx)).set(self.collection_root)
+            usage.record_layer(self.layer_node)
 
         self.influence = self.layer_node.evalParm("influence_" + str(self.idx))
         self.thumbnail_binary = item_infos.thumbnail_binary
@@ -115,9 +126,8 @@ class CollectionInstanceWidget(QtWidgets.QWidget):
         self.thumbnail = QtWidgets.QLabel()
         self.thumbnail.setFixedWidth(90)
         self.thumbnail.setFixedHeight(90)
-        self.pixmap = QtGui.QPixmap()
-        self.pixmap.loadFromData(self.thumbnail_binary)
-        self.pixmap = self.pixmap.scaledToHeight(90, QtCore.Qt.TransformationMode.SmoothTransformation)
+        self.pixmap = thumbnailCache.get_cache().get(self.uid, THUMBNAIL_SIZE,
+                                                     lambda: self.thumbnail_binary)
         self.thumbnail.setPixmap(self.pixmap)
         self.thumbnail.setStyleSheet("""QLabel{border: 1px solid black}""")
         self.main_layout.addWidget(self.thumbnail)
@@ -139,6 +149,7 @@ class CollectionInstanceWidget(QtWidgets.QWidget):
 
         instances = self.layer_node.parm("instances")
         instances.removeMultiParmInstance(self.idx - 1)
+        usage.record_layer(self.layer_node, [self.collection_root])
 
         self.top_w.remove_item(self)
 
@@ -201,12 +212,18 @@ class CollectionInstanceWidget(QtWidgets.QWidget):
 
     def dropEvent(self, event):
         
+        mime_data = event.mimeData()
+        if not mime_data.hasFormat(indexIO.ASSET_MIME_TYPE):
+            return
+
         try:
-            data = event.mimeData().text()
-            data = eval(data)
-            self.top_w.append_item(data)
-        except SyntaxError:
-            print("Error: bad formating metadata")
+            items = indexIO.resolve_asset_refs(mime_data.data(indexIO.ASSET_MIME_TYPE))
+        except ValueError:
+            print("Error: bad formating asset references")
+            return
+
+        for metadata in items:
+            self.top_w.append_item(metadata)
 
 class InfluenceBarWidget(QtWidgets.QWidget):
     """ Special custom slider used in the collection thumbnail widget
@@ -13,8 +13,15 @@ reload(strokes)
 from GaiaCollectionPy import ui as GC_ui
 reload(GC_ui)
 
+from GaiaCollectionPy.core import indexIO
+reload(indexIO)
+from GaiaCollectionPy.core import localCache
+reload(localCache)
+
 from GaiaCommon import nodeInfos
 reload(nodeInfos)
+from GaiaCommon import thumbnailCache
+reload(thumbnailCache)
 
 from ...ui import widgets
 reload(widgets)
@@ -22,6 +29,9 @@ reload(widgets)
 from ...core import cache
 reload(cache)
 
+from ...core import usage
+reload(usage)
+
 from ...ui import col_widgets
 reload(col_widgets)
 
@@ -332,6 +342,7 @@ class LayerTabWidget(QtWidgets.QWidget):
                                   severity=hou.severityType.Warning)
         if r == 1: return
 
+        usage.forget_layer(self.layer_infos.node)
         self.layer_infos.node.destroy()
         self.tabs_widget.remove_layer(self.id)
 
@@ -1187,8 +1198,8 @@ class InstancesListWidget(QtWidgets.QWidget):
                 root = self.node.evalParm("collection_root_" + i).replace('\\', '/')
                 metadata_name = asset_path.split('/')[-1].replace('_' + uid, "") + ".json"
                 metadata_path = root + asset_category + '/' + metadata_name
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
+                # thumbnail is only read when the item widget is built
+                metadata = indexIO.read_metadata(metadata_path)
 
                 metadata["collection_root"] = root
                 instances_metadata.append(metadata)
@@ -1200,6 +1211,11 @@ class InstancesListWidget(QtWidgets.QWidget):
 
         if instances_metadata:
             self.init_collection_grid_items(instances_metadata)
+
+        # the hip file may have been saved under another name since the
+        # usage was recorded
+        if instances:
+            usage.record_layer(self.node)
             
         main_layout.setAlignment(QtCore.Qt.AlignLeft)
         self.setLayout(main_layout)
@@ -1305,10 +1321,17 @@ class InstanceItemsContainer(QtWidgets.QFrame):
         comment = metadata["comment"]
         category = metadata["category"]
         format = metadata["format"]
-        _path = metadata["path"].replace('\\', '/')
-        _path = _path.replace("%ROOT%", metadata["collection_root"])
-        _path = _path.replace('\\', '/') + '/'
-        _path += _name + '.' + format
+        # assets sharing a blob of the content-addressed store share the
+        # same file, loaded once by the packed disk primitives cache
+        _path = indexIO.geometry_path(metadata["collection_root"], metadata)
+        _path = _path.replace('\\', '/')
+
+        # the file parm keeps the collection path, the local copy ( when the
+        # local cache is enabled ) is resolved when the file is loaded as the
+        # cache is local to this machine. The copy is fetched now and pinned
+        # while the instance is displayed.
+        localCache.local_path(_path, pin=True)
+        file_expr = localCache.local_path_expression(_path)
 
         # append item to collection subnet
         collection_sub = cache.get("CURRENT_GAIA_SCATTER_COLLECTION")
@@ -1318,7 +1341,7 @@ class InstanceItemsContainer(QtWidgets.QFrame):
             col_item.setComment("Collection item, file: " + _path)
             _file = col_item.node("file1")
             _file.setName("import_file")
-            _file.parm("file").set(_path)
+            _file.parm("file").setExpression(file_expr, hou.exprLanguage.Python)
             _file.parm("loadtype").set(4)
             _file.parm("viewportlod").set(0)
             output = col_item.createNode("output", "OUT_" + _name)
@@ -1335,13 +1358,22 @@ class InstanceItemsContainer(QtWidgets.QFrame):
             output.setRenderFlag(True)
             col_item.layoutChildren()
 
+        else:
+            file_parm = col_item.node("import_file").parm("file")
+            try:
+                current_expr = file_parm.expression()
+            except hou.OperationFailed:
+                # plain path, set by older versions
+                current_expr = None
+            if current_expr != file_expr:
+                file_parm.setExpression(file_expr, hou.exprLanguage.Python)
+
         # display state of collection item
         item_inf.visible = col_item.node("show_object").evalParm("input")
         item_inf.display_mode = col_item.node("import_file").evalParm("viewportlod")
 
         collection_sub.layoutChildren()
 
-        thumbnail_binary = base64.decodestring(metadata["thumbnail"])
         tooltip = ("Asset name: {}\n"
                    "Category: {}\n"
                    "Format: {}\n"
@@ -1355,12 +1387,20 @@ class InstanceItemsContainer(QtWidgets.QFrame):
         item_inf.tooltip = tooltip
         item_inf.idx = idx
         item_inf.collection_root = metadata["collection_root"]
-        item_inf.thumbnail_binary = thumbnail_binary
+        # the thumbnail data is only needed when not already cached
+        if (uid, col_widgets.THUMBNAIL_SIZE) not in thumbnailCache.get_cache():
+            item_inf.thumbnail_binary = indexIO.get_thumbnail(metadata["collection_root"],
+                                                              metadata,
+                                                              col_widgets.THUMBNAIL_SIZE)
 
         w = col_widgets.CollectionInstanceWidget(layer_node=self.node, item_infos=item_inf,
                                                  set_parms=set_instances_parm,
                                                  parent=self)
 
+        # released when the instance is removed, its layer deleted or the
+        # scatter closed, the widget is destroyed in every case
+        w.destroyed.connect(lambda *args: localCache.unpin(_path))
+
         return w
         
 
@@ -1404,9 +1444,15 @@ class InstanceItemsContainer(QtWidgets.QFrame):
 
     def dropEvent(self, event):
         
+        mime_data = event.mimeData()
+        if not mime_data.hasFormat(indexIO.ASSET_MIME_TYPE):
+            return
+
         try:
-            data = event.mimeData().text()
-            data = eval(data)
-            self.top_w.append_item(data)
-        except SyntaxError:
-            print("Error: bad formating metadata")
\ No newline at end of file
+            items = indexIO.resolve_asset_refs(mime_data.data(indexIO.ASSET_MIME_TYPE))
+        except ValueError:
+            print("Error: bad formating asset references")
+            return
+
+        for metadata in items:
+            self.top_w.append_item(metadata)
\ No newline at end of file
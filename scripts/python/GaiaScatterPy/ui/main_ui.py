@@ -79,6 +79,13 @@ class MainUI(QtWidgets.QWidget):
     def update_layer_widget(self):
         """ Create or update default layer widget
         """
+        # the previous scatter is closed
+        previous = getattr(self, "layers_w", None)
+        if previous is not None:
+            self.main_layout.removeWidget(previous)
+            previous.setParent(None)
+            previous.deleteLater()
+
         top_asset = hou.node(self.gaia_node_path.text())
         self.layers_w = layer_widget.LayersWidget(top_asset, parent=self)
         self.main_layout.addWidget(self.layers_w)